@@ -0,0 +1,89 @@
+"""Compare encode time and size of the captcha image formats.
+
+Draws --images captchas once and encodes each of them in every format and
+setting below, so only the encoding is measured.
+
+Usage: python benchmarks/bench_encode.py [--images 50] [--width 280] [--height 90] [--font path.ttf]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import features
+
+from cogs import captcha_render
+
+FALLBACK_FONTS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/System/Library/Fonts/Helvetica.ttc",
+    "C:\\Windows\\Fonts\\Arial.ttf",
+    "arial.ttf",
+]
+
+# (label, settings overrides)
+CASES = [
+    ("png level 6 (Pillow default)", {"image_format": "png", "compress_level": 6}),
+    ("png level 1", {"image_format": "png", "compress_level": 1}),
+    ("png level 9", {"image_format": "png", "compress_level": 9}),
+    ("png_palette 64 colors level 6", {"image_format": "png_palette", "palette_colors": 64, "compress_level": 6}),
+    ("png_palette 32 colors level 6", {"image_format": "png_palette", "palette_colors": 32, "compress_level": 6}),
+    ("png_palette 32 colors level 1", {"image_format": "png_palette", "palette_colors": 32, "compress_level": 1}),
+    ("png_palette 16 colors level 6", {"image_format": "png_palette", "palette_colors": 16, "compress_level": 6}),
+    ("webp quality 80 method 0", {"image_format": "webp", "image_quality": 80, "webp_method": 0}),
+    ("webp quality 80 method 4", {"image_format": "webp", "image_quality": 80, "webp_method": 4}),
+    ("webp quality 60 method 0", {"image_format": "webp", "image_quality": 60, "webp_method": 0}),
+    ("jpeg quality 85", {"image_format": "jpeg", "image_quality": 85}),
+    ("jpeg quality 70", {"image_format": "jpeg", "image_quality": 70}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--width", type=int, default=280)
+    parser.add_argument("--height", type=int, default=90)
+    parser.add_argument("--font", default=next((path for path in FALLBACK_FONTS if os.path.exists(path)), "arial.ttf"))
+    args = parser.parse_args()
+
+    settings = {
+        "length": 6, "width": args.width, "height": args.height, "font_size": 40, "font_path": args.font,
+        "noise_density": 20, "noise_lines": 8, "glyph_angle_step": 5, "glyph_cache_size": 512,
+        "image_format": "png", "compress_level": 6, "palette_colors": 32, "image_quality": 80, "webp_method": 0,
+    }
+    images = [
+        captcha_render.draw_captcha("".join(captcha_render.random.choices(captcha_render.CAPTCHA_ALPHABET, k=6)),
+                                    settings)
+        for _ in range(args.images)
+    ]
+
+    print(f"{args.images} images of {args.width}x{args.height}")
+    baseline_ms = baseline_bytes = None
+    for label, overrides in CASES:
+        if overrides["image_format"] == "webp" and not features.check("webp"):
+            print(f"{label:<32} skipped, Pillow was built without WebP")
+            continue
+
+        case_settings = dict(settings, **overrides)
+        timings = []
+        sizes = []
+        for image in images:
+            start = time.perf_counter()
+            encoded = captcha_render.encode_captcha(image, case_settings)
+            timings.append(time.perf_counter() - start)
+            sizes.append(len(encoded))
+
+        encode_ms = statistics.mean(timings) * 1000
+        size = statistics.mean(sizes)
+        if baseline_ms is None:
+            baseline_ms, baseline_bytes = encode_ms, size
+
+        print(f"{label:<32} {encode_ms:7.3f} ms  {size:8.0f} B  "
+              f"({encode_ms / baseline_ms:5.2f}x time, {size / baseline_bytes:5.2f}x size)")
+
+
+if __name__ == "__main__":
+    main()
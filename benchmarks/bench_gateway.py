@@ -0,0 +1,133 @@
+"""Compare memory and event processing cost of the minimal and full bot footprint.
+
+Feeds synthetic gateway events through discord.py's event parsers, no
+Discord connection is needed. Each footprint only receives the events its
+intents subscribe to: with the full footprint every guild arrives with its
+members and presences, with the minimal one guilds arrive without members.
+Both are offered the same traffic of messages and presence updates, the
+minimal footprint never receives the presence updates.
+
+Usage: python benchmarks/bench_gateway.py [--guilds 20] [--members 5000] [--events 50000]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+from discord.ext import commands
+
+import main
+
+BOT_ID = 1
+
+
+def user_payload(user_id: int) -> dict:
+    return {"id": str(user_id), "username": f"user{user_id}", "discriminator": "0",
+            "avatar": None, "global_name": None}
+
+
+def member_payload(user_id: int) -> dict:
+    return {"user": user_payload(user_id), "roles": [], "joined_at": "2024-01-01T00:00:00+00:00",
+            "deaf": False, "mute": False, "flags": 0}
+
+
+def presence_payload(guild_id: int, user_id: int, activity: int) -> dict:
+    return {"user": {"id": str(user_id)}, "guild_id": str(guild_id), "status": "online",
+            "activities": [{"name": f"Game {activity}", "type": 0}], "client_status": {"desktop": "online"}}
+
+
+def guild_payload(guild_id: int, members: int, with_members: bool) -> dict:
+    member_ids = [guild_id * 1_000_000 + i for i in range(members)] if with_members else []
+    return {
+        "id": str(guild_id), "name": f"Guild {guild_id}", "owner_id": str(BOT_ID), "large": True,
+        "member_count": members + 1, "features": [], "emojis": [], "stickers": [], "threads": [],
+        "voice_states": [], "stage_instances": [], "guild_scheduled_events": [], "soundboard_sounds": [],
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False}],
+        "channels": [{"id": str(guild_id + 1), "type": 0, "name": "verify", "position": 0,
+                      "permission_overwrites": []}],
+        "members": [member_payload(BOT_ID)] + [member_payload(user_id) for user_id in member_ids],
+        "presences": [presence_payload(guild_id, user_id, 0) for user_id in member_ids],
+    }
+
+
+def message_payload(guild_id: int, user_id: int, message_id: int) -> dict:
+    member = member_payload(user_id)
+    return {"id": str(message_id), "channel_id": str(guild_id + 1), "guild_id": str(guild_id),
+            "author": member.pop("user"), "member": member, "content": "hello", "type": 0,
+            "timestamp": "2024-01-01T00:00:00+00:00", "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [],
+            "embeds": [], "pinned": False}
+
+
+def event_stream(guild_ids, members: int, events: int, intents: discord.Intents):
+    """Yield the ``(event, payload)`` pairs out of ``events`` that ``intents`` subscribe to.
+
+    Busy guilds see far more presence updates than messages, every fourth
+    event is a message here.
+    """
+    for n in range(events):
+        guild_id = guild_ids[n % len(guild_ids)]
+        user_id = guild_id * 1_000_000 + n % members
+        if n % 4 == 0:
+            yield "MESSAGE_CREATE", message_payload(guild_id, user_id, 10**12 + n)
+        elif intents.presences:
+            yield "PRESENCE_UPDATE", presence_payload(guild_id, user_id, n)
+
+
+async def run(footprint: str, guilds: int, members: int, events: int):
+    options = main.bot_options(footprint, members=False)
+    bot = commands.Bot(command_prefix="!", **options)
+    async with bot:
+        state = bot._connection
+        state.user = discord.ClientUser(state=state, data=user_payload(BOT_ID))
+        # Chunking would need a gateway connection, the payloads are measured on their own
+        state._chunk_guilds = False
+
+        base_mb = main.resident_memory_mb()
+        guild_ids = [(index + 1) * 10**9 for index in range(guilds)]
+        for guild_id in guild_ids:
+            state.parsers["GUILD_CREATE"](guild_payload(guild_id, members, options["intents"].members))
+        cached_members = sum(len(guild.members) for guild in bot.guilds)
+        guild_mb = main.resident_memory_mb() - base_mb
+
+        stream = list(event_stream(guild_ids, members, events, options["intents"]))
+        start = time.perf_counter()
+        for index, (event, payload) in enumerate(stream):
+            state.parsers[event](payload)
+            if index % 1000 == 0:
+                # Let the scheduled on_message handlers run
+                await asyncio.sleep(0)
+        elapsed = time.perf_counter() - start
+
+        print(f"{footprint:>8}: {cached_members:>8} cached members, +{guild_mb:7.1f} MB for guilds, "
+              f"{main.resident_memory_mb():7.1f} MB RSS total, "
+              f"{len(stream):>6} events received, {elapsed * 1000:6.0f} ms, {events / elapsed:8.0f} offered events/s")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--members", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--footprint", choices=("minimal", "full"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.footprint:
+        asyncio.run(run(args.footprint, args.guilds, args.members, args.events))
+        return
+
+    print(f"{args.guilds} guilds with {args.members} members, {args.events} gateway events")
+    # One process per footprint so the memory numbers don't influence each other
+    for footprint in ("full", "minimal"):
+        subprocess.run([sys.executable, __file__, "--footprint", footprint, "--guilds", str(args.guilds),
+                        "--members", str(args.members), "--events", str(args.events)], check=True)
+
+
+if __name__ == "__main__":
+    main_cli()
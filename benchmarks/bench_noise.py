@@ -0,0 +1,50 @@
+"""Compare the vectorized captcha noise against the pixel by pixel loop.
+
+Usage: python benchmarks/bench_noise.py [--width 280] [--height 90] [--density 20] [--lines 8] [--runs 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from cogs import captcha_render
+
+
+def bench(noise_func, width: int, height: int, density: int, lines: int, runs: int) -> float:
+    """Return the average time in milliseconds for one noise pass"""
+    start = time.perf_counter()
+    for _ in range(runs):
+        image = Image.new('RGB', (width, height), color=(255, 255, 255))
+        noise_func(image, density, lines)
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--width", type=int, default=280)
+    parser.add_argument("--height", type=int, default=90)
+    parser.add_argument("--density", type=int, default=20)
+    parser.add_argument("--lines", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    params = (args.width, args.height, args.density, args.lines, args.runs)
+    print(f"{args.width}x{args.height}, one speckle per {args.density} pixels, {args.lines} lines, {args.runs} runs")
+
+    loop_ms = bench(captcha_render.draw_noise_loop, *params)
+    print(f"loop:  {loop_ms:8.3f} ms/image")
+
+    if captcha_render.np is None:
+        print("numpy: not installed")
+        return
+
+    numpy_ms = bench(captcha_render.draw_noise_numpy, *params)
+    print(f"numpy: {numpy_ms:8.3f} ms/image ({loop_ms / numpy_ms:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
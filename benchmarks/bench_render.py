@@ -0,0 +1,283 @@
+"""Benchmark captcha generation and compare the results between commits.
+
+Runs generate_captcha_text, generate_captcha_image and create_captcha of the
+verification cog for every combination of the given sizes, text lengths and
+fonts, without a Discord connection. For each it reports renders per second,
+p50/p99 latency, the peak Python heap while rendering and the image size.
+
+Usage:
+    python benchmarks/bench_render.py [--sizes 280x90,400x120] [--lengths 6,8] [--fonts a.ttf,b.ttf]
+                                      [--runs 200] [--save] [--compare benchmarks/results/<commit>.json]
+
+--save writes the results to benchmarks/results/<label>.json, the label defaults
+to the current git commit. --compare prints the change against an earlier
+result file and exits with status 1 if a case got slower or larger by more
+than --threshold percent.
+"""
+import argparse
+import asyncio
+import copy
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cogs import captcha_render
+from cogs.captcha_render import CaptchaRenderer
+from cogs.verify import CaptchaVerification
+from cogs.verify_config import DEFAULT_CONFIG, VerifyConfig
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+FALLBACK_FONTS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/System/Library/Fonts/Helvetica.ttc",
+    "C:\\Windows\\Fonts\\Arial.ttf",
+    "arial.ttf",
+]
+
+BASE_SETTINGS = {
+    "length": 6,
+    "width": 280,
+    "height": 90,
+    "font_size": 40,
+    "font_path": "arial.ttf",
+    "noise_density": 20,
+    "noise_lines": 8,
+    "glyph_angle_step": 5,
+    "glyph_cache_size": 512,
+    "image_format": "png",
+    "palette_colors": 32,
+    "compress_level": 6,
+    "image_quality": 80,
+    "webp_method": 0,
+}
+
+# Compared with --compare, higher is worse for all of them
+REGRESSION_METRICS = ("p50_ms", "p99_ms", "peak_heap_kb", "image_bytes")
+
+
+def default_font() -> str:
+    return next((path for path in FALLBACK_FONTS if os.path.exists(path)), FALLBACK_FONTS[-1])
+
+
+def bench_cog(settings: dict, renderer: CaptchaRenderer) -> CaptchaVerification:
+    """A cog with just enough state for the captcha methods, no bot, config file or database"""
+    cog = CaptchaVerification.__new__(CaptchaVerification)
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config["captcha_settings"].update(settings)
+    cog.config = VerifyConfig(config)
+    cog.renderer = renderer
+    cog.captcha_pool = None
+    cog.raid = None
+    return cog
+
+
+def percentile(samples, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def summarize(timings, image_sizes=None) -> dict:
+    total = sum(timings)
+    result = {
+        "runs": len(timings),
+        "per_second": round(len(timings) / total, 1) if total else 0.0,
+        "p50_ms": round(percentile(timings, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+    }
+    if image_sizes:
+        result["image_bytes"] = round(statistics.mean(image_sizes))
+    return result
+
+
+def bench_text(cog: CaptchaVerification, runs: int) -> dict:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        cog.generate_captcha_text()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+def bench_image(cog: CaptchaVerification, runs: int) -> dict:
+    # Warm the glyph atlas first, it is built once per font and reused afterwards
+    cog.generate_captcha_image(cog.generate_captcha_text())
+
+    timings = []
+    image_sizes = []
+    for _ in range(runs):
+        text = cog.generate_captcha_text()
+        start = time.perf_counter()
+        image = cog.generate_captcha_image(text)
+        timings.append(time.perf_counter() - start)
+        image_sizes.append(image.getbuffer().nbytes)
+
+    result = summarize(timings, image_sizes)
+
+    # Measured separately, tracing allocations slows rendering down
+    tracemalloc.start()
+    for _ in range(min(runs, 20)):
+        cog.generate_captcha_image(cog.generate_captcha_text())
+    result["peak_heap_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    tracemalloc.stop()
+
+    return result
+
+
+async def bench_create(cog: CaptchaVerification, runs: int, concurrency: int) -> dict:
+    """Time create_captcha with ``concurrency`` calls in flight, like a join burst"""
+    await cog.create_captcha()
+
+    timings = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await cog.create_captcha()
+            timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(runs)))
+    elapsed = time.perf_counter() - start
+
+    result = summarize(timings)
+    # Latencies overlap, so throughput comes from the wall clock time
+    result["per_second"] = round(runs / elapsed, 1)
+    return result
+
+
+async def run_cases(args) -> dict:
+    sizes = [tuple(int(value) for value in size.split("x")) for size in args.sizes.split(",")]
+    lengths = [int(length) for length in args.lengths.split(",")]
+    fonts = args.fonts.split(",") if args.fonts else [default_font()]
+
+    renderer = CaptchaRenderer(backend=args.backend, workers=args.workers)
+    cases = {}
+
+    try:
+        for (width, height), length, font in itertools.product(sizes, lengths, fonts):
+            settings = dict(BASE_SETTINGS, width=width, height=height, length=length, font_path=font,
+                            image_format=args.format, warp=args.warp)
+            cog = bench_cog(settings, renderer)
+            name = f"{width}x{height} len{length} {os.path.basename(font)} {args.format}"
+            if args.warp != "none":
+                # Unwarped cases keep their names so older result files still compare
+                name += f" warp {args.warp}"
+
+            cases[name] = {
+                "generate_captcha_text": bench_text(cog, args.runs),
+                "generate_captcha_image": bench_image(cog, args.runs),
+                "create_captcha": await bench_create(cog, args.runs, args.concurrency),
+            }
+            print_case(name, cases[name])
+    finally:
+        renderer.shutdown()
+
+    return cases
+
+
+def print_case(name: str, case: dict):
+    print(name)
+    for function, result in case.items():
+        extra = ""
+        if "image_bytes" in result:
+            extra = f", {result['image_bytes']:>6} B image, {result['peak_heap_kb']:>7} KB peak heap"
+        print(f"  {function:<24} {result['per_second']:>9}/s  p50 {result['p50_ms']:>8.3f} ms  "
+              f"p99 {result['p99_ms']:>8.3f} ms{extra}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(previous: dict, current: dict, threshold: float) -> int:
+    """Print the change per metric, returns the number of regressions above ``threshold`` percent"""
+    regressions = 0
+    print(f"\nCompared with {previous['label']} ({previous['commit']}):")
+
+    for name, case in current["cases"].items():
+        old_case = previous["cases"].get(name)
+        if old_case is None:
+            print(f"  {name}: no earlier result")
+            continue
+
+        for function, result in case.items():
+            for metric in REGRESSION_METRICS:
+                old = old_case.get(function, {}).get(metric)
+                new = result.get(metric)
+                if not old or new is None:
+                    continue
+
+                change = (new - old) / old * 100
+                flag = ""
+                if change > threshold:
+                    flag = "  <-- regression"
+                    regressions += 1
+                print(f"  {name} {function} {metric}: {old} -> {new} ({change:+.1f}%){flag}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="280x90", help="comma separated WIDTHxHEIGHT list")
+    parser.add_argument("--lengths", default="6", help="comma separated captcha text lengths")
+    parser.add_argument("--fonts", default="", help="comma separated font paths, default is a system font")
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--format", choices=captcha_render.IMAGE_FORMATS, default=BASE_SETTINGS["image_format"],
+                        help="image_format of the captchas")
+    parser.add_argument("--warp", choices=captcha_render.WARP_MODES, default="none", help="warp of the captchas")
+    parser.add_argument("--backend", choices=captcha_render.RENDER_BACKENDS, default="thread",
+                        help="render backend used by create_captcha")
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=16, help="create_captcha calls in flight")
+    parser.add_argument("--save", action="store_true", help="save the results to benchmarks/results")
+    parser.add_argument("--label", default="", help="result file name, defaults to the git commit")
+    parser.add_argument("--compare", default="", help="earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percent")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results = {
+        "label": args.label or commit,
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": captcha_render.np is not None,
+        "backend": args.backend,
+        "image_format": args.format,
+        "warp": args.warp,
+        "runs": args.runs,
+        "cases": asyncio.run(run_cases(args)),
+    }
+
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{results['label']}.json")
+        with open(path, "w") as result_file:
+            json.dump(results, result_file, indent=4)
+        print(f"\nSaved results to {path}")
+
+    if args.compare:
+        with open(args.compare) as result_file:
+            previous = json.load(result_file)
+        if compare(previous, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compare the cost of the warp modes with making captchas harder through more noise.
+
+Renders --images captchas per case with the default captcha settings and
+reports draw time, draw + encode time and image size against the current
+pipeline without warping. The warp fields are built before timing starts,
+their one-off build time is reported separately.
+
+Usage: python benchmarks/bench_warp.py [--images 200] [--strength 4] [--grid 20] [--font path.ttf]
+"""
+import argparse
+import copy
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs import captcha_render
+from cogs.verify_config import DEFAULT_CONFIG, resolve_font
+
+# (label, settings overrides)
+CASES = [
+    ("no warp (current)", {"warp": "none"}),
+    ("no warp, 4x noise", {"warp": "none", "noise_density": 5, "noise_lines": 24}),
+    ("wave", {"warp": "wave"}),
+    ("perspective", {"warp": "perspective"}),
+    ("mixed", {"warp": "mixed"}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--strength", type=float, default=DEFAULT_CONFIG["captcha_settings"]["warp_strength"])
+    parser.add_argument("--grid", type=int, default=DEFAULT_CONFIG["captcha_settings"]["warp_grid"])
+    parser.add_argument("--font", default=resolve_font(DEFAULT_CONFIG["captcha_settings"]["font_path"]))
+    args = parser.parse_args()
+
+    settings = copy.deepcopy(DEFAULT_CONFIG["captcha_settings"])
+    settings.update(font_path=args.font, warp_strength=args.strength, warp_grid=args.grid)
+    texts = ["".join(random.choices(captcha_render.CAPTCHA_ALPHABET, k=settings["length"])) for _ in range(args.images)]
+
+    print(f"{args.images} captchas of {settings['width']}x{settings['height']}, "
+          f"warp strength {args.strength}, grid {args.grid}, {settings['warp_fields']} fields")
+    baseline = None
+    for label, overrides in CASES:
+        case_settings = dict(settings, **overrides)
+
+        start = time.perf_counter()
+        if case_settings["warp"] != "none":
+            captcha_render.get_warp_fields(case_settings)
+        build_ms = (time.perf_counter() - start) * 1000
+        # Warm up the glyph atlas
+        captcha_render.draw_captcha(texts[0], case_settings)
+
+        draw_times = []
+        render_times = []
+        sizes = []
+        for text in texts:
+            start = time.perf_counter()
+            image = captcha_render.draw_captcha(text, case_settings)
+            drawn = time.perf_counter()
+            encoded = captcha_render.encode_captcha(image, case_settings)
+            draw_times.append(drawn - start)
+            render_times.append(time.perf_counter() - start)
+            sizes.append(len(encoded))
+
+        draw_ms = statistics.mean(draw_times) * 1000
+        render_ms = statistics.mean(render_times) * 1000
+        size = statistics.mean(sizes)
+        if baseline is None:
+            baseline = render_ms
+
+        print(f"{label:<20} draw {draw_ms:6.2f} ms  draw+encode {render_ms:6.2f} ms ({render_ms / baseline:4.2f}x)  "
+              f"{size:7.0f} B  fields built in {build_ms:6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""Drive the verification flow with fake Discord objects to size the bot for raids.
+
+Simulated users arrive at --rate per second for --duration seconds, spread
+over --guilds guilds. Each one clicks Verify, then "Enter Captcha" and
+submits the modal through the cog's own callbacks. A user either answers
+correctly, answers wrong --wrong-attempts times before getting it right (or
+gets locked out), or abandons the captcha without opening the modal.
+
+Every reply to Discord takes --api-latency seconds, like a real HTTP call,
+and --render-delay is added to every captcha render to simulate an overloaded
+renderer. Like Discord, an interaction that isn't acknowledged within 3
+seconds fails with "Unknown interaction"; these are reported as missed acks.
+Run with --no-defer to see how many clicks fail without deferring slow answers.
+The cog runs in a temporary directory with its own config and database.
+
+Usage:
+    python benchmarks/load_sim.py [--rate 50] [--duration 20] [--guilds 5]
+                                  [--correct 0.7] [--wrong 0.2] [--abandon 0.1]
+                                  [--backend process] [--stateless] [--no-pool] [--no-raid] [--metrics]
+                                  [--render-delay 0] [--no-defer]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+
+from main import resident_memory_mb
+from cogs.verify import CaptchaVerification
+from cogs.verify_pipeline import INTERACTION_DEADLINE, UNKNOWN_INTERACTION
+
+VERIFIED_ROLE_ID = 42
+
+
+class FakeRole:
+    def __init__(self, role_id: int):
+        self.id = role_id
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.role = FakeRole(VERIFIED_ROLE_ID)
+
+    def get_role(self, role_id: int):
+        return self.role if role_id == self.role.id else None
+
+
+class FakeMember:
+    def __init__(self, user_id: int, api_latency: float):
+        self.id = user_id
+        self.api_latency = api_latency
+        self.roles = []
+
+    async def add_roles(self, *roles):
+        await asyncio.sleep(self.api_latency)
+        self.roles.extend(roles)
+
+
+class FakeHTTPResponse:
+    status = 404
+    reason = "Not Found"
+
+
+class FakeResponse:
+    """Records the first reply to an interaction and how long the cog took to send it"""
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.kind = None
+        self.modal = None
+
+    def is_done(self) -> bool:
+        return self.kind is not None
+
+    async def _respond(self, kind: str, kwargs: dict):
+        if self.kind is not None:
+            raise discord.InteractionResponded(self.interaction)
+        # Discord forgets interactions that weren't acknowledged in time
+        if time.perf_counter() - self.interaction.received_at > INTERACTION_DEADLINE:
+            raise discord.NotFound(FakeHTTPResponse(), {"code": UNKNOWN_INTERACTION, "message": "Unknown interaction"})
+        self.kind = kind
+        self.interaction.acked_at = time.perf_counter()
+        if kind != "defer":
+            self.interaction.reply = kwargs
+        await asyncio.sleep(self.interaction.api_latency)
+
+    async def send_message(self, content=None, **kwargs):
+        await self._respond("send_message", dict(kwargs, content=content))
+
+    async def edit_message(self, **kwargs):
+        await self._respond("edit_message", kwargs)
+
+    async def send_modal(self, modal):
+        self.modal = modal
+        await self._respond("send_modal", {})
+
+    async def defer(self, **kwargs):
+        await self._respond("defer", kwargs)
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.interaction.api_latency)
+        self.interaction.reply = dict(kwargs, content=content)
+
+
+class FakeInteraction:
+    def __init__(self, client, guild: FakeGuild, user: FakeMember, api_latency: float):
+        self.client = client
+        self.guild = guild
+        self.user = user
+        self.api_latency = api_latency
+        # created_at is what the cog measures the deadline from, received_at what the simulation does
+        self.created_at = discord.utils.utcnow()
+        self.received_at = time.perf_counter()
+        self.acked_at = None
+        self.reply = {}
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, **kwargs):
+        await asyncio.sleep(self.api_latency)
+        self.reply = kwargs
+
+
+class FakeBot:
+    """The parts of commands.Bot the cog touches while loading and handling interactions"""
+
+    def __init__(self):
+        self.cog = None
+        self.guilds = []
+        self.shard_count = None
+
+    def add_view(self, view, message_id=None):
+        pass
+
+    def add_dynamic_items(self, *items):
+        pass
+
+    def remove_dynamic_items(self, *items):
+        pass
+
+    def get_cog(self, name: str):
+        return self.cog
+
+    def dispatch(self, event_name: str, *args):
+        pass
+
+    def get_guild(self, guild_id: int):
+        return None
+
+    def get_channel(self, channel_id: int):
+        return None
+
+
+class Simulation:
+    def __init__(self, args):
+        self.args = args
+        self.bot = FakeBot()
+        self.guilds = [FakeGuild(1000 + index) for index in range(args.guilds)]
+        self.api_latency = args.api_latency
+
+        self.solutions = {}
+        self.ack_times = {"verify_button": [], "captcha_button": [], "modal_submit": []}
+        self.outcomes = {"verified": 0, "locked_out": 0, "abandoned": 0, "interaction_failed": 0, "errors": 0}
+        self.interactions = 0
+        self.loop_lag = []
+
+    async def load_cog(self) -> CaptchaVerification:
+        cog = CaptchaVerification(self.bot)
+        self.bot.cog = cog
+
+        # Remember the solution of every challenge so simulated users can answer it
+        start_challenge = cog.start_challenge
+
+        def recording_start_challenge(guild_id, user_id, solution):
+            self.solutions[(guild_id, user_id)] = solution
+            return start_challenge(guild_id, user_id, solution)
+
+        cog.start_challenge = recording_start_challenge
+
+        if self.args.render_delay:
+            render = cog.renderer.render
+
+            async def slow_render(text, settings):
+                await asyncio.sleep(self.args.render_delay)
+                return await render(text, settings)
+
+            cog.renderer.render = slow_render
+
+        await cog.cog_load()
+        return cog
+
+    async def interact(self, stage: str, callback, guild: FakeGuild, member: FakeMember) -> FakeInteraction:
+        interaction = FakeInteraction(self.bot, guild, member, self.api_latency)
+        self.interactions += 1
+        await callback(interaction)
+        if interaction.acked_at is not None:
+            self.ack_times[stage].append(interaction.acked_at - interaction.received_at)
+        return interaction
+
+    @staticmethod
+    def captcha_button(view: discord.ui.View):
+        for item in view.children:
+            if isinstance(item, (discord.ui.Button, discord.ui.DynamicItem)):
+                return item
+        return None
+
+    async def user_session(self, cog: CaptchaVerification, user_id: int, behaviour: str):
+        guild = random.choice(self.guilds)
+        member = FakeMember(user_id, self.api_latency)
+        wrong_answers = self.args.wrong_attempts if behaviour == "wrong" else 0
+
+        try:
+            interaction = await self.interact("verify_button", cog.handle_verification_button, guild, member)
+            view = interaction.reply.get("view")
+
+            while view is not None:
+                if behaviour == "abandon":
+                    self.outcomes["abandoned"] += 1
+                    return
+
+                # A user needs a moment to read the captcha
+                await asyncio.sleep(random.uniform(0, self.args.think_time))
+
+                interaction = await self.interact("captcha_button", self.captcha_button(view).callback, guild, member)
+                modal = interaction.response.modal
+                if modal is None:
+                    break
+
+                if wrong_answers > 0:
+                    modal.answer._value = "WRONG"
+                    wrong_answers -= 1
+                else:
+                    modal.answer._value = self.solutions[(guild.id, user_id)]
+
+                interaction = await self.interact("modal_submit", modal.on_submit, guild, member)
+                view = interaction.reply.get("view")
+
+            if member.roles:
+                self.outcomes["verified"] += 1
+            elif cog.lockouts.remaining(guild.id, user_id) > 0:
+                self.outcomes["locked_out"] += 1
+            elif interaction.acked_at is None:
+                # The user saw "This interaction failed"
+                self.outcomes["interaction_failed"] += 1
+        except Exception as e:
+            self.outcomes["errors"] += 1
+            print(f"Simulated user {user_id} failed: {e!r}")
+
+    async def sample_loop_lag(self, interval: float = 0.05):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(loop.time() - start - interval)
+
+    async def run(self):
+        args = self.args
+        cog = await self.load_cog()
+        # Let the captcha pool fill up before the raid starts
+        await asyncio.sleep(args.warmup)
+
+        tracemalloc.start()
+        start_mb = resident_memory_mb()
+        lag_task = asyncio.create_task(self.sample_loop_lag())
+        behaviours = ("correct", "wrong", "abandon")
+        weights = (args.correct, args.wrong, args.abandon)
+
+        sessions = []
+        start = time.perf_counter()
+        total_users = int(args.rate * args.duration)
+        for user_index in range(total_users):
+            # Keep arrivals on schedule even when the loop falls behind
+            delay = start + user_index / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            behaviour = random.choices(behaviours, weights)[0]
+            sessions.append(asyncio.create_task(self.user_session(cog, 10_000 + user_index, behaviour)))
+
+        await asyncio.gather(*sessions)
+        elapsed = time.perf_counter() - start
+        await cog.flush_pending_writes()
+
+        lag_task.cancel()
+        end_mb = resident_memory_mb()
+        heap_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        self.report(cog, total_users, elapsed, start_mb, end_mb, heap_peak)
+        await cog.cog_unload()
+
+    def report(self, cog, users: int, elapsed: float, start_mb: float, end_mb: float, heap_peak: int):
+        print(f"\n{users} users in {elapsed:.1f}s ({users / elapsed:.1f} users/s, "
+              f"{self.interactions / elapsed:.1f} interactions/s)")
+        print("Outcomes: " + ", ".join(f"{name} {count}" for name, count in self.outcomes.items()))
+        print(f"Verified per second: {self.outcomes['verified'] / elapsed:.1f}")
+
+        print("\nTime to acknowledge (Discord allows 3s):")
+        for stage, timings in self.ack_times.items():
+            if timings:
+                print(f"  {stage:<15} p50 {percentile(timings, 0.5) * 1000:8.1f} ms  "
+                      f"p99 {percentile(timings, 0.99) * 1000:8.1f} ms  max {max(timings) * 1000:8.1f} ms  "
+                      f"over 3s: {sum(timing > 3 for timing in timings)}")
+
+        if self.loop_lag:
+            print(f"\nEvent loop lag: p50 {percentile(self.loop_lag, 0.5) * 1000:.1f} ms, "
+                  f"p99 {percentile(self.loop_lag, 0.99) * 1000:.1f} ms, max {max(self.loop_lag) * 1000:.1f} ms")
+
+        db_stats = cog.db.stats()
+        print(f"Database: {cog.db.total_query_time * 1000:.1f} ms total query time, "
+              f"{db_stats['queries']} queries, {db_stats['flushes']} flushes, avg batch {db_stats['avg_batch']}")
+        print(f"Memory: {start_mb:.1f} MB -> {end_mb:.1f} MB RSS ({end_mb - start_mb:+.1f} MB), "
+              f"peak Python heap {heap_peak / (1024 * 1024):.1f} MB")
+
+        print("\nRendering: " + json.dumps(cog.renderer.stats()))
+        if cog.captcha_pool:
+            print("Captcha pool: " + json.dumps(cog.captcha_pool.stats()))
+        if cog.raid:
+            print("Raid mode: " + json.dumps(cog.raid.stats()))
+        print("Verification state: " + json.dumps(cog.state.stats()))
+        print("Interactions: " + json.dumps(cog.pipeline.stats(), ensure_ascii=False))
+
+        if cog.metrics.enabled:
+            print("\n" + cog.metrics.render())
+
+
+def percentile(samples, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def write_config(args):
+    config = {
+        "verified_role_id": VERIFIED_ROLE_ID,
+        "captcha_settings": {"render_backend": args.backend, "render_workers": args.workers},
+        "verification_settings": {"db_filename": "load_sim.db", "defer_slow_responses": not args.no_defer},
+        "stateless_challenges": {"enabled": args.stateless},
+        "captcha_pool": {"enabled": not args.no_pool},
+        "raid_mode": {"enabled": not args.no_raid},
+        "metrics": {"enabled": args.metrics, "http_port": 0},
+    }
+    with open("verify_config.json", "w") as config_file:
+        json.dump(config, config_file, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=50, help="new users per second")
+    parser.add_argument("--duration", type=float, default=20, help="seconds users keep arriving")
+    parser.add_argument("--guilds", type=int, default=5)
+    parser.add_argument("--correct", type=float, default=0.7, help="share of users answering correctly")
+    parser.add_argument("--wrong", type=float, default=0.2, help="share of users answering wrong first")
+    parser.add_argument("--abandon", type=float, default=0.1, help="share of users never answering")
+    parser.add_argument("--wrong-attempts", type=int, default=2, help="wrong answers before the right one")
+    parser.add_argument("--think-time", type=float, default=2.0, help="max seconds a user takes to answer")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="seconds per Discord API call")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds to let the captcha pool fill")
+    parser.add_argument("--backend", default="process", help="render backend")
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--stateless", action="store_true", help="use signed stateless challenges")
+    parser.add_argument("--no-pool", action="store_true", help="disable the captcha pool")
+    parser.add_argument("--no-raid", action="store_true", help="disable raid mode detection")
+    parser.add_argument("--render-delay", type=float, default=0.0, help="extra seconds added to every render")
+    parser.add_argument("--no-defer", action="store_true", help="never defer slow answers")
+    parser.add_argument("--metrics", action="store_true", help="enable metrics and print them at the end")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="captcha_load_sim_")
+    previous_dir = os.getcwd()
+    os.chdir(workdir)
+    try:
+        write_config(args)
+        asyncio.run(Simulation(args).run())
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
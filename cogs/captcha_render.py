@@ -0,0 +1,541 @@
+import asyncio
+import io
+import math
+import multiprocessing
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont, ImageFilter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+RENDER_BACKENDS = ("inline", "thread", "process")
+
+CAPTCHA_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ" + "23456789"
+
+MAX_ROTATION = 25
+
+# Atlases for the font configurations seen recently, see get_glyph_atlas
+MAX_ATLASES = 4
+
+# image_format setting -> (Pillow format, file extension)
+IMAGE_FORMATS = {
+    "png": ("PNG", "png"),
+    "png_palette": ("PNG", "png"),
+    "webp": ("WEBP", "webp"),
+    "jpeg": ("JPEG", "jpg"),
+}
+
+# warp setting values, see build_warp_field
+WARP_MODES = ("none", "wave", "perspective", "mixed")
+
+# Warp field sets for the image sizes and warp settings seen recently, see get_warp_fields
+MAX_WARP_SETS = 8
+
+_rng = np.random.default_rng() if np is not None else None
+_atlases: "OrderedDict[tuple, GlyphAtlas]" = OrderedDict()
+_warp_sets: "OrderedDict[tuple, list]" = OrderedDict()
+
+
+class GlyphAtlas:
+    """Cache of pre-rotated glyph images for one font and size.
+
+    Rotations are quantized to multiples of ``angle_step`` degrees between
+    -MAX_ROTATION and MAX_ROTATION, so the whole alphabet only needs a few
+    hundred images. At most ``max_entries`` images are kept, least recently
+    used ones are dropped first.
+    """
+
+    def __init__(self, font_path: str, font_size: int, angle_step: int = 5, max_entries: int = 512):
+        try:
+            self.font = ImageFont.truetype(font_path, font_size)
+        except Exception as e:
+            print(f"Error loading font: {e}")
+            self.font = ImageFont.load_default()
+
+        angle_step = min(max(int(angle_step), 1), MAX_ROTATION)
+        self.angles = tuple(range(-(MAX_ROTATION // angle_step) * angle_step, MAX_ROTATION + 1, angle_step))
+        self.max_entries = max(int(max_entries), 1)
+
+        alphabet_bbox = self.font.getbbox(CAPTCHA_ALPHABET)
+        self.line_height = alphabet_bbox[3] - alphabet_bbox[1]
+
+        self._glyphs: "OrderedDict[Tuple[str, int], Image.Image]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        # Pre-render the whole alphabet if it fits, otherwise fill lazily
+        if len(CAPTCHA_ALPHABET) * len(self.angles) <= self.max_entries:
+            for char in CAPTCHA_ALPHABET:
+                for angle in self.angles:
+                    self._glyphs[(char, angle)] = self._render_glyph(char, angle)
+
+    def _render_glyph(self, char: str, angle: int) -> Image.Image:
+        char_bbox = self.font.getbbox(char)
+        char_img = Image.new('RGBA', (char_bbox[2] - char_bbox[0] + 10, self.line_height + 20), (255, 255, 255, 0))
+        char_draw = ImageDraw.Draw(char_img)
+        char_draw.text((5, 10), char, font=self.font, fill=(0, 0, 0))
+
+        return char_img.rotate(angle, expand=True, fillcolor=(255, 255, 255, 0), resample=Image.BICUBIC)
+
+    def get(self, char: str, angle: int) -> Image.Image:
+        key = (char, angle)
+        glyph = self._glyphs.get(key)
+
+        if glyph is None:
+            self.misses += 1
+            glyph = self._render_glyph(char, angle)
+            self._glyphs[key] = glyph
+            if len(self._glyphs) > self.max_entries:
+                self._glyphs.popitem(last=False)
+        else:
+            self.hits += 1
+            self._glyphs.move_to_end(key)
+
+        return glyph
+
+
+def get_glyph_atlas(settings: dict) -> GlyphAtlas:
+    """Return the atlas for the font settings, building it on first use.
+
+    Atlases are keyed on everything that affects the glyph images, so changing
+    the font, size or cache settings simply starts a new atlas and the stale
+    one ages out.
+    """
+    key = (settings["font_path"], settings["font_size"], settings["glyph_angle_step"], settings["glyph_cache_size"])
+    atlas = _atlases.get(key)
+
+    if atlas is None:
+        atlas = GlyphAtlas(*key)
+        _atlases[key] = atlas
+        if len(_atlases) > MAX_ATLASES:
+            _atlases.popitem(last=False)
+    else:
+        _atlases.move_to_end(key)
+
+    return atlas
+
+
+def render_captcha(text: str, settings: dict) -> bytes:
+    """Render the captcha image for the given text and return the encoded bytes.
+
+    This is a plain module level function so it can be shipped to a worker
+    process; everything it needs is passed in through ``settings``.
+    """
+    return encode_captcha(draw_captcha(text, settings), settings)
+
+
+def draw_captcha(text: str, settings: dict) -> Image.Image:
+    width = settings["width"]
+    height = settings["height"]
+
+    image = Image.new('RGB', (width, height), color=(255, 255, 255))
+    atlas = get_glyph_atlas(settings)
+
+    text_bbox = atlas.font.getbbox(text)
+    text_width = text_bbox[2] - text_bbox[0]
+    text_height = text_bbox[3] - text_bbox[1]
+    text_x = (width - text_width) // 2
+    text_y = (height - text_height) // 2
+
+    image = draw_noise(image, settings["noise_density"], settings["noise_lines"])
+
+    for i, char in enumerate(text):
+        char_x = text_x + i * (text_width // len(text))
+        char_y = text_y + random.randint(-10, 10)
+
+        char_img = atlas.get(char, random.choice(atlas.angles))
+        image.paste(char_img, (char_x, char_y), char_img)
+
+    image = warp_image(image, settings)
+
+    return image.filter(ImageFilter.GaussianBlur(radius=0.5))
+
+
+def captcha_filename(settings: dict) -> str:
+    """Attachment name for captchas encoded with ``settings``"""
+    return f"captcha.{IMAGE_FORMATS.get(settings['image_format'], IMAGE_FORMATS['png'])[1]}"
+
+
+def encode_captcha(image: Image.Image, settings: dict) -> bytes:
+    """Encode the image in the configured ``image_format``.
+
+    ``png`` keeps every color, ``png_palette`` first reduces the image to
+    ``palette_colors`` colors which makes it both smaller and faster to
+    compress. ``compress_level`` (0-9) applies to both PNG variants,
+    ``image_quality`` (1-100) to ``webp`` and ``jpeg``.
+    """
+    image_format = settings["image_format"]
+    pil_format = IMAGE_FORMATS.get(image_format, IMAGE_FORMATS["png"])[0]
+
+    byte_array = io.BytesIO()
+    if pil_format == "PNG":
+        if image_format == "png_palette":
+            image = image.quantize(colors=settings["palette_colors"], method=Image.Quantize.FASTOCTREE)
+        image.save(byte_array, format="PNG", compress_level=settings["compress_level"])
+    elif pil_format == "WEBP":
+        image.save(byte_array, format="WEBP", quality=settings["image_quality"], method=settings["webp_method"])
+    else:
+        image.save(byte_array, format="JPEG", quality=settings["image_quality"])
+
+    return byte_array.getvalue()
+
+
+def draw_noise_loop(image: Image.Image, density: int, lines: int) -> Image.Image:
+    """Draw speckles and lines pixel by pixel, used when NumPy isn't installed"""
+    width, height = image.size
+    draw = ImageDraw.Draw(image)
+
+    for _ in range(width * height // density):
+        x = random.randint(0, width - 1)
+        y = random.randint(0, height - 1)
+        draw.point((x, y), fill=(random.randint(0, 200), random.randint(0, 200), random.randint(0, 200)))
+
+    for _ in range(lines):
+        x1 = random.randint(0, width - 1)
+        y1 = random.randint(0, height - 1)
+        x2 = random.randint(0, width - 1)
+        y2 = random.randint(0, height - 1)
+        draw.line([(x1, y1), (x2, y2)],
+                  fill=(random.randint(0, 200), random.randint(0, 200), random.randint(0, 200)), width=1)
+
+    return image
+
+
+def draw_noise_numpy(image: Image.Image, density: int, lines: int) -> Image.Image:
+    """Same noise as ``draw_noise_loop`` but generated as arrays in one batch"""
+    width, height = image.size
+    pixels = np.array(image)
+
+    count = width * height // density
+    xs = _rng.integers(0, width, count)
+    ys = _rng.integers(0, height, count)
+    pixels[ys, xs] = _rng.integers(0, 201, (count, 3), dtype=np.uint8)
+
+    if lines:
+        start = _rng.integers(0, (width, height), (lines, 2))
+        end = _rng.integers(0, (width, height), (lines, 2))
+
+        # Sample every line at the same number of steps as the longest one needs,
+        # shorter lines just hit some pixels more than once
+        steps = int(np.abs(end - start).max()) + 1
+        t = np.linspace(0.0, 1.0, steps)
+        points = np.rint(start[:, None, :] + (end - start)[:, None, :] * t[None, :, None]).astype(np.intp)
+
+        colors = _rng.integers(0, 201, (lines, 3), dtype=np.uint8)
+        pixels[points[..., 1], points[..., 0]] = np.repeat(colors, steps, axis=0).reshape(lines, steps, 3)
+
+    return Image.fromarray(pixels)
+
+
+def draw_noise(image: Image.Image, density: int, lines: int) -> Image.Image:
+    """Add background noise to ``image``, one speckle per ``density`` pixels plus ``lines`` random lines"""
+    density = max(int(density), 1)
+    if np is not None:
+        return draw_noise_numpy(image, density, lines)
+    return draw_noise_loop(image, density, lines)
+
+
+def build_warp_field(width: int, height: int, mode: str, strength: float, grid: int) -> list:
+    """Random ``Image.MESH`` data that bends an image of the given size.
+
+    ``wave`` shifts rows and columns along sine waves, ``perspective`` moves
+    the corners to tilt the image like a photo taken at an angle, ``mixed``
+    does both. ``strength`` is the largest shift in pixels. The image is cut
+    into ``grid`` sized cells, each mapped from the displaced quad of the
+    source, so applying the field is a single resampling pass.
+    """
+    grid = max(int(grid), 2)
+    wave = mode in ("wave", "mixed")
+    perspective = mode in ("perspective", "mixed")
+
+    # Wave periods of one half to one and a half times the image size with random phase
+    period_x = random.uniform(0.5, 1.5) * height
+    period_y = random.uniform(0.5, 1.5) * width
+    phase_x = random.uniform(0, 2 * math.pi)
+    phase_y = random.uniform(0, 2 * math.pi)
+    # Corner displacements (top left, top right, bottom left, bottom right)
+    corners = [(random.uniform(-strength, strength), random.uniform(-strength, strength)) for _ in range(4)]
+
+    def source(x: int, y: int) -> Tuple[float, float]:
+        source_x, source_y = float(x), float(y)
+        if wave:
+            source_x += strength * math.sin(2 * math.pi * y / period_x + phase_x)
+            source_y += strength / 2 * math.sin(2 * math.pi * x / period_y + phase_y)
+        if perspective:
+            u, v = x / width, y / height
+            weights = ((1 - u) * (1 - v), u * (1 - v), (1 - u) * v, u * v)
+            source_x += sum(weight * dx for weight, (dx, _) in zip(weights, corners))
+            source_y += sum(weight * dy for weight, (_, dy) in zip(weights, corners))
+        return source_x, source_y
+
+    mesh = []
+    for top in range(0, height, grid):
+        bottom = min(top + grid, height)
+        for left in range(0, width, grid):
+            right = min(left + grid, width)
+            # Source quad corners in the order Image.MESH expects: NW, SW, SE, NE
+            quad = (*source(left, top), *source(left, bottom), *source(right, bottom), *source(right, top))
+            mesh.append(((left, top, right, bottom), quad))
+
+    return mesh
+
+
+def get_warp_fields(settings: dict) -> list:
+    """Return the precomputed warp fields for the image size and warp settings, building them on first use"""
+    key = (settings["width"], settings["height"], settings["warp"], settings["warp_strength"],
+           settings["warp_grid"], settings["warp_fields"])
+    fields = _warp_sets.get(key)
+
+    if fields is None:
+        fields = [build_warp_field(*key[:5]) for _ in range(max(int(key[5]), 1))]
+        _warp_sets[key] = fields
+        if len(_warp_sets) > MAX_WARP_SETS:
+            _warp_sets.popitem(last=False)
+    else:
+        _warp_sets.move_to_end(key)
+
+    return fields
+
+
+def warp_image(image: Image.Image, settings: dict) -> Image.Image:
+    """Distort the image with one of the precomputed fields of its ``warp`` mode, ``none`` leaves it as is"""
+    if settings.get("warp", "none") not in WARP_MODES[1:] or settings["warp_strength"] <= 0:
+        return image
+
+    mesh = random.choice(get_warp_fields(settings))
+    return image.transform(image.size, Image.Transform.MESH, mesh, resample=Image.Resampling.BILINEAR,
+                           fillcolor=(255, 255, 255))
+
+
+def _seed_worker():
+    # Make sure every worker gets its own random state so they don't all
+    # produce the same noise pattern.
+    global _rng
+    random.seed(int.from_bytes(os.urandom(8), "big"))
+    if np is not None:
+        _rng = np.random.default_rng()
+
+
+class CaptchaRenderer:
+    """Runs ``render_captcha`` off the event loop.
+
+    ``backend`` is one of ``inline`` (render on the loop, the old behaviour),
+    ``thread`` or ``process``. At most ``max_concurrent`` renders are handed to
+    the executor at once, everything beyond that waits on a semaphore and is
+    counted as queued.
+    """
+
+    def __init__(self, backend: str = "process", workers: int = 0, max_concurrent: int = 0):
+        if backend not in RENDER_BACKENDS:
+            print(f"Unknown render backend '{backend}', falling back to 'thread'")
+            backend = "thread"
+
+        self.backend = backend
+        self.workers = workers or os.cpu_count() or 1
+        self.max_concurrent = max_concurrent or self.workers * 2
+        self._executor: Optional[Executor] = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        self.queued = 0
+        self.in_flight = 0
+        self.peak_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_render_time = 0.0
+        self.max_render_time = 0.0
+
+        # Optional callback with the render time and image size of every render
+        self.on_render = None
+
+    def _get_executor(self) -> Optional[Executor]:
+        if self.backend == "inline":
+            return None
+
+        if self._executor is None:
+            if self.backend == "process":
+                # Forking a process that already runs threads (database, aiohttp) can
+                # deadlock the child, so workers are started from a clean process
+                context = multiprocessing.get_context("spawn")
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                                     initializer=_seed_worker)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="captcha-render")
+
+        return self._executor
+
+    async def render(self, text: str, settings: dict) -> bytes:
+        self.queued += 1
+        self.peak_queued = max(self.peak_queued, self.queued)
+
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+
+        self.in_flight += 1
+        start = time.perf_counter()
+
+        try:
+            executor = self._get_executor()
+            if executor is None:
+                image_bytes = render_captcha(text, settings)
+            else:
+                loop = asyncio.get_running_loop()
+                image_bytes = await loop.run_in_executor(executor, render_captcha, text, settings)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+        elapsed = time.perf_counter() - start
+        self.completed += 1
+        self.total_render_time += elapsed
+        self.max_render_time = max(self.max_render_time, elapsed)
+        if self.on_render is not None:
+            self.on_render(elapsed, len(image_bytes))
+
+        return image_bytes
+
+    def stats(self) -> Dict[str, float]:
+        average = self.total_render_time / self.completed if self.completed else 0.0
+
+        return {
+            "backend": self.backend,
+            "workers": self.workers,
+            "max_concurrent": self.max_concurrent,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_render_ms": round(average * 1000, 2),
+            "max_render_ms": round(self.max_render_time * 1000, 2),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class CaptchaPool:
+    """Keeps a warm pool of pre-rendered ``(solution, image bytes)`` pairs.
+
+    ``take`` is a plain deque pop. Once the pool drops below ``low_water`` the
+    background task renders new captchas until it is back at ``size``, one at
+    a time and at no more than ``refill_per_second`` renders per second, so
+    the refill holds at most one of the renderer's slots and on-demand renders
+    never queue behind a whole batch.
+    """
+
+    def __init__(self, renderer: CaptchaRenderer, text_factory, settings_factory,
+                 size: int = 200, low_water: int = 50, refill_per_second: int = 20):
+        self.renderer = renderer
+        self.text_factory = text_factory
+        self.settings_factory = settings_factory
+        self.size = max(size, 1)
+        self.low_water = min(max(low_water, 0), self.size)
+        self.refill_per_second = max(refill_per_second, 1)
+
+        self._entries = deque()
+        # Bumped by clear(), renders started before it are dropped
+        self._generation = 0
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.refilled = 0
+        self.refill_errors = 0
+
+    def start(self):
+        if self._task is None:
+            self._wake.set()
+            self._task = asyncio.create_task(self._refill_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def take(self) -> Optional[Tuple[str, bytes]]:
+        try:
+            entry = self._entries.popleft()
+        except IndexError:
+            self.misses += 1
+            self._wake.set()
+            return None
+
+        self.hits += 1
+        if len(self._entries) < self.low_water:
+            self._wake.set()
+
+        return entry
+
+    def clear(self):
+        """Drop all pre-rendered captchas, e.g. after the captcha settings changed"""
+        self._entries.clear()
+        self._generation += 1
+        self._wake.set()
+
+    async def _render_one(self):
+        text = self.text_factory()
+        image_bytes = await self.renderer.render(text, self.settings_factory())
+        return text, image_bytes
+
+    async def _refill_loop(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+
+            interval = 1 / self.refill_per_second
+            while len(self._entries) < self.size:
+                started = loop.time()
+                generation = self._generation
+
+                try:
+                    entry = await self._render_one()
+                except Exception as e:
+                    self.refill_errors += 1
+                    print(f"Error pre-rendering captcha: {e}")
+                else:
+                    # Rendered with settings that were cleared in the meantime
+                    if generation == self._generation:
+                        self._entries.append(entry)
+                        self.refilled += 1
+
+                # Spread the refill over time instead of saturating the renderer
+                elapsed = loop.time() - started
+                if elapsed < interval:
+                    await asyncio.sleep(interval - elapsed)
+
+    def stats(self) -> Dict[str, float]:
+        requests = self.hits + self.misses
+
+        return {
+            "available": len(self._entries),
+            "size": self.size,
+            "low_water": self.low_water,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 3) if requests else 0.0,
+            "refilled": self.refilled,
+            "refill_errors": self.refill_errors,
+        }
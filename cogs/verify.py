@@ -1,317 +1,491 @@
 import discord
-import sqlite3
 import random
 import asyncio
 import os
 import io
-import json
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+import secrets
+import time
 from discord.ext import commands
 from discord import app_commands
 from typing import Dict, List, Optional, Tuple
 
-
-def load_config():
-    """Load configuration from JSON file or create a default one if it doesn't exist"""
-    config_path = "verify_config.json"
-
-    default_config = {
-        "verified_role_id": 1342506397526655046,
-        "captcha_settings": {
-            "length": 6,
-            "width": 280,
-            "height": 90,
-            "font_size": 40,
-            "font_path": "arial.ttf"
-        },
-        "verification_settings": {
-            "max_attempts": 5,
-            "timeout_minutes": 10,
-            "db_filename": "captcha_verification.db"
-        },
-        "messages": {
-            "welcome": "Welcome to the server. Please complete the captcha verification process to gain access.",
-            "already_verified": "Your account has already been verified on this server.",
-            "verification_success": "Verification completed successfully. You now have full access to the server.",
-            "verification_failed": "The captcha entry was incorrect. Please attempt verification again.",
-            "verification_timeout": "Maximum verification attempts exceeded. Please try again after the timeout period."
-        }
-    }
-
-    # Check if config file exists
-    if not os.path.exists(config_path):
-        # Create default config file
-        with open(config_path, 'w') as config_file:
-            json.dump(default_config, config_file, indent=4)
-        print(f"Created default configuration file at {config_path}")
-        return default_config
-
-    # Load existing config
-    try:
-        with open(config_path, 'r') as config_file:
-            config = json.load(config_file)
-        print(f"Loaded configuration from {config_path}")
-        return config
-    except Exception as e:
-        print(f"Error loading config: {e}")
-        print("Using default configuration")
-        return default_config
+from cogs.captcha_render import CAPTCHA_ALPHABET, CaptchaPool, CaptchaRenderer, render_captcha
+from cogs.verify_config import (CONFIG_PATH, GUILD_SETTINGS, GuildConfigCache, VerifyConfig, load_config, read_config,
+                                save_config)
+from cogs.verify_db import (EVENT_FAILED, EVENT_ISSUED, EVENT_LOCKED_OUT, EVENT_NAMES, EVENT_SOLVED,
+                            VerificationDatabase)
+from cogs.verify_metrics import CaptchaMetrics, instrument_interaction
+from cogs.verify_pipeline import ResponsePipeline
+from cogs.verify_raid import RaidDetector
+from cogs.verify_reconcile import RECONCILE_SOURCES, RoleReconciler
+from cogs.verify_retention import RetentionJob
+from cogs.verify_state import ChallengeSigner, ChallengeStateStore, LockoutScheduler
 
 
 class CaptchaVerification(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.config = load_config()
-        self.active_captchas: Dict[int, str] = {}
-        self.user_attempts: Dict[int, int] = {}
-        self.timeouts: Dict[int, float] = {}
+        config_data = load_config()
+
+        # In stateless mode the challenge lives in a signed button custom_id instead of self.state
+        stateless_settings = config_data["stateless_challenges"]
+        if stateless_settings["enabled"] and not stateless_settings["secret"]:
+            stateless_settings["secret"] = secrets.token_hex(32)
+            # Save the generated secret so it survives restarts
+            save_config(config_data)
+
+        self.config = VerifyConfig(config_data)
+        self.guild_configs = GuildConfigCache(self.config)
+        self._config_mtime = self._read_config_mtime()
+        self._config_task: Optional[asyncio.Task] = None
+
+        verification_settings = self.config.section("verification_settings")
+        self.state = ChallengeStateStore(
+            ttl=self.config.challenge_ttl,
+            max_entries=verification_settings["max_tracked_users"],
+            sweep_interval=verification_settings["state_sweep_seconds"]
+        )
+        self.lockouts = LockoutScheduler(self._end_lockouts)
+
+        self.signer: Optional[ChallengeSigner] = None
+        if stateless_settings["enabled"]:
+            self.signer = ChallengeSigner(stateless_settings["secret"], ttl=self.config.challenge_ttl)
+
+        captcha_settings = self.config.section("captcha_settings")
+        render_workers = captcha_settings["render_workers"]
+        process_count = getattr(bot, "process_count", 1)
+        if not render_workers and process_count > 1:
+            # The launcher's processes share the cores instead of each starting one worker per core
+            render_workers = max(1, (os.cpu_count() or 1) // process_count)
+        self.renderer = CaptchaRenderer(
+            backend=captcha_settings["render_backend"],
+            workers=render_workers,
+            max_concurrent=captcha_settings["max_concurrent_renders"]
+        )
 
-        self._init_db()
+        pool_settings = self.config.section("captcha_pool")
+        self.captcha_pool: Optional[CaptchaPool] = None
+        if pool_settings["enabled"]:
+            self.captcha_pool = CaptchaPool(
+                self.renderer,
+                self.generate_captcha_text,
+                self._pool_settings,
+                size=pool_settings["size"],
+                low_water=pool_settings["low_water"],
+                refill_per_second=pool_settings["refill_per_second"]
+            )
+
+        self._buttons_checked = False
+        self._reconciling: Dict[int, RoleReconciler] = {}
+        self.buttons_restored = 0
+        self.buttons_pruned = 0
+        self.restore_seconds = 0.0
+
+        self.db = VerificationDatabase(
+            verification_settings["db_filename"],
+            flush_interval=verification_settings["write_flush_interval"],
+            batch_size=verification_settings["write_batch_size"],
+            shard_count=bot.shard_count,
+            shard_ids=getattr(bot, "shard_ids", None)
+        )
+
+        retention_settings = self.config.section("retention")
+        self.retention: Optional[RetentionJob] = None
+        self.forget_departed_members = retention_settings["forget_departed_members"]
+        if retention_settings["enabled"]:
+            self.retention = RetentionJob(
+                self.db,
+                interval_seconds=retention_settings["interval_minutes"] * 60,
+                batch_size=retention_settings["batch_size"],
+                batch_pause=retention_settings["batch_pause_seconds"],
+                event_days=retention_settings["event_days"],
+                minute_rollup_days=retention_settings["minute_rollup_days"],
+                hour_rollup_days=retention_settings["hour_rollup_days"],
+                vacuum_pages=retention_settings["vacuum_pages"],
+                # Pruning and compacting the shared file is done once, by the process with shard 0
+                maintenance=self.db.shard_ids is None or 0 in self.db.shard_ids
+            )
+
+        raid_settings = self.config.section("raid_mode")
+        self.raid: Optional[RaidDetector] = None
+        if raid_settings["enabled"]:
+            self.raid = RaidDetector(
+                self._on_raid_mode,
+                window_seconds=raid_settings["window_seconds"],
+                enter_joins_per_minute=raid_settings["enter_joins_per_minute"],
+                enter_clicks_per_minute=raid_settings["enter_clicks_per_minute"],
+                exit_ratio=raid_settings["exit_ratio"],
+                cooldown_seconds=raid_settings["cooldown_seconds"],
+                duplicate_click_seconds=raid_settings["duplicate_click_seconds"],
+                check_seconds=raid_settings["check_seconds"]
+            )
+
+        metrics_settings = self.config.section("metrics")
+        http_port = metrics_settings["http_port"]
+        file_path = metrics_settings["file_path"]
+        if process_count > 1:
+            # Every launcher process gets its own endpoint and file: http_port + index, metrics.prom -> metrics.1.prom
+            process_index = getattr(bot, "process_index", 0)
+            if http_port:
+                http_port += process_index
+            if file_path:
+                root, extension = os.path.splitext(file_path)
+                file_path = f"{root}.{process_index}{extension}"
+        self.metrics = CaptchaMetrics(
+            enabled=metrics_settings["enabled"],
+            http_host=metrics_settings["http_host"],
+            http_port=http_port,
+            file_path=file_path,
+            file_interval=metrics_settings["file_interval"],
+            loop_lag_interval=metrics_settings["loop_lag_interval"]
+        )
+        if self.metrics.enabled:
+            self.renderer.on_render = self._observe_render
+            self.db.on_query = self.metrics.db_query_seconds.observe
+
+        self.pipeline = ResponsePipeline(
+            defer_slow=verification_settings["defer_slow_responses"],
+            ack_margin=verification_settings["ack_margin_seconds"]
+        )
+        if self.metrics.enabled:
+            self.pipeline.on_stage = self.metrics.interaction_stage_seconds.observe
+            self.pipeline.on_defer = self.metrics.deferred_responses.inc
 
         os.makedirs("fonts", exist_ok=True)
 
+    async def cog_load(self):
+        # The buttons are routed by their custom_id, so no view object is kept per message or challenge
+        self.bot.add_dynamic_items(VerifyButton, self.CaptchaButton, self.SignedCaptchaButton)
+        await self.db.open()
+        self.guild_configs.load(await self.db.load_guild_settings())
+        self.state.start()
+
+        if self.config.persist_lockouts:
+            self.lockouts.load(await self.db.load_lockouts())
+        self.lockouts.start()
+
+        if self.captcha_pool:
+            self.captcha_pool.start()
+        if self.raid:
+            self.raid.start()
+        if self.retention:
+            self.retention.start()
+
+        await self.metrics.start()
+
+        if self.config.reload_seconds > 0:
+            self._config_task = asyncio.create_task(self._watch_config())
+
+    async def cog_unload(self):
+        if self._config_task is not None:
+            self._config_task.cancel()
+        await self.metrics.stop()
+        if self.raid:
+            await self.raid.stop()
+        if self.retention:
+            await self.retention.stop()
+        await self.state.stop()
+        await self.lockouts.stop()
+        if self.captcha_pool:
+            await self.captcha_pool.stop()
+        self.renderer.shutdown()
+        await self.db.close()
+        self.bot.remove_dynamic_items(VerifyButton, self.CaptchaButton, self.SignedCaptchaButton)
+
+    @staticmethod
+    def _read_config_mtime() -> float:
         try:
-            font_path = self.config["captcha_settings"]["font_path"]
-            if not os.path.exists(font_path):
-                system_fonts = [
-                    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",  # Linux
-                    "/System/Library/Fonts/Helvetica.ttc",  # MacOS
-                    "C:\\Windows\\Fonts\\Arial.ttf",  # Windows
-                    "arial.ttf",  # Fallback
-                ]
-
-                for font_path in system_fonts:
-                    if os.path.exists(font_path):
-                        self.config["captcha_settings"]["font_path"] = font_path
-                        # Save the updated config
-                        with open("verify_config.json", 'w') as config_file:
-                            json.dump(self.config, config_file, indent=4)
-                        break
+            return os.stat(CONFIG_PATH).st_mtime
+        except OSError:
+            return 0.0
+
+    async def _watch_config(self):
+        """Reload verify_config.json whenever its modification time changes"""
+        while True:
+            await asyncio.sleep(self.config.reload_seconds)
+            if self._read_config_mtime() != self._config_mtime:
+                await self.reload_config()
+
+    async def reload_config(self) -> bool:
+        """Apply verify_config.json again without restarting, returns False if the file couldn't be read.
+
+        Captcha, message, attempt and timeout settings take effect right away.
+        Settings used to start workers, the database, the pool or the metrics
+        endpoint only change after a restart.
+        """
+        self._config_mtime = self._read_config_mtime()
+        try:
+            config = VerifyConfig(read_config())
         except Exception as e:
-            print(f"Font initialization error: {e}")
-
-    def _init_db(self):
-        db_filename = self.config["verification_settings"]["db_filename"]
-        conn = sqlite3.connect(db_filename)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS verified_users (
-            user_id INTEGER PRIMARY KEY,
-            guild_id INTEGER,
-            verified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS active_buttons (
-            button_id TEXT PRIMARY KEY,
-            message_id INTEGER,
-            channel_id INTEGER,
-            guild_id INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
+            print(f"Error reloading config, keeping the previous one: {e}")
+            return False
+
+        # Pre-rendered captchas were made with the old settings
+        if self.captcha_pool and config.captcha != self.config.captcha:
+            self.captcha_pool.clear()
+
+        self.config = config
+        self.guild_configs.set_config(config)
+        self.guild_configs.load(await self.db.load_guild_settings())
+        self.state.ttl = config.challenge_ttl
+        verification_settings = config.section("verification_settings")
+        self.pipeline.defer_slow = verification_settings["defer_slow_responses"]
+        self.pipeline.ack_margin = verification_settings["ack_margin_seconds"]
+        if self.signer:
+            self.signer.ttl = config.challenge_ttl
+
+        print("Reloaded verification config")
+        return True
+
+    def _on_raid_mode(self, guild_id: int, active: bool, rates: Dict[str, float]):
+        """Called by the raid detector whenever a guild enters or leaves raid mode"""
+        details = ", ".join(f"{key} {value}" for key, value in rates.items())
+        print(f"Guild {guild_id} {'entered' if active else 'left'} raid mode ({details})")
+        self.metrics.raid_mode_changes.inc(state="entered" if active else "left")
+
+        # Write in larger, less frequent batches while any guild is raided
+        verification_settings = self.config.section("verification_settings")
+        raid_settings = self.config.section("raid_mode")
+        if self.raid.active_guilds:
+            self.db.flush_interval = raid_settings["write_flush_interval"]
+            self.db.batch_size = max(raid_settings["write_batch_size"], 1)
+        else:
+            self.db.flush_interval = verification_settings["write_flush_interval"]
+            self.db.batch_size = max(verification_settings["write_batch_size"], 1)
+
+        # Listeners can react with on_verification_raid_mode(guild_id, active, rates)
+        self.bot.dispatch("verification_raid_mode", guild_id, active, rates)
+
+    def _pool_settings(self) -> dict:
+        # Refill with the cheaper settings while a raid drains the pool
+        if self.raid and self.raid.active_guilds:
+            return self.config.raid_captcha
+        return self.config.captcha
+
+    def attempt_limits(self, guild_id: int) -> Tuple[int, int]:
+        """Max attempts and timeout minutes for the guild, tightened while it is in raid mode"""
+        guild_config = self.guild_configs.get(guild_id)
+        if self.raid and self.raid.is_active(guild_id):
+            return (min(guild_config.max_attempts, self.config.raid_max_attempts),
+                    max(guild_config.timeout_minutes, self.config.raid_timeout_minutes))
+        return guild_config.max_attempts, guild_config.timeout_minutes
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        # Only delivered with the members intent, which main.py adds when enter_joins_per_minute is set
+        if self.raid:
+            self.raid.record_join(member.guild.id)
+
+    @commands.Cog.listener()
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        # The raw event arrives without the member cache, but only with the members intent,
+        # which main.py adds when forget_departed_members is on
+        self.state.clear(payload.guild_id, payload.user.id)
+        if self.retention and self.forget_departed_members:
+            self.retention.forget_member(payload.guild_id, payload.user.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        if self.retention:
+            self.forget_guild(guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        # Added back before the retention job ran, don't purge what is verified from now on
+        if self.retention:
+            self.retention.keep_guild(guild.id)
+
+    def forget_guild(self, guild_id: int):
+        """Drop a guild the bot was removed from, the retention job deletes its rows"""
+        self.guild_configs.clear_overrides(guild_id)
+        self.retention.forget_guild(guild_id)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if self.retention and payload.message_id in self.db.button_messages:
+            self.retention.forget_messages([payload.message_id])
 
-        conn.commit()
-        conn.close()
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        if self.retention:
+            self.retention.forget_messages(payload.message_ids)
+
+    def _departed_guilds(self, stored_guild_ids) -> List[int]:
+        """Stored guilds of this process the bot is no longer in, e.g. removed while it was offline"""
+        return [guild_id for guild_id in set(stored_guild_ids)
+                if self.db.owns_guild(guild_id) and self.bot.get_guild(guild_id) is None]
 
+    @instrument_interaction("verify_button")
     async def handle_verification_button(self, interaction: discord.Interaction):
         """Handle clicks on the verification button"""
         user_id = interaction.user.id
         guild_id = interaction.guild.id
+        trace = self.pipeline.trace("verify_button")
+
+        # During a raid, repeated clicks are answered without rendering another captcha
+        if self.raid and self.raid.record_click(guild_id, user_id):
+            self.metrics.shed_clicks.inc()
+            await self.pipeline.send(
+                interaction,
+                content="Your captcha is already on its way. Please use the one you received or try again in a few seconds."
+            )
+            return
 
         # Check if user is already verified
         if self.is_verified(user_id, guild_id):
             already_verified_embed = discord.Embed(
                 title="✅ Verification Status",
-                description=self.config["messages"]["already_verified"],
+                description=self.guild_configs.get(guild_id).already_verified_message,
                 color=discord.Color.green()
             )
 
-            await interaction.response.send_message(
-                embed=already_verified_embed,
-                ephemeral=True
-            )
+            await self.pipeline.send(interaction, embed=already_verified_embed)
             return
 
         # Check if user is in timeout
-        if user_id in self.timeouts:
-            timeout_end = self.timeouts[user_id]
-            current_time = asyncio.get_event_loop().time()
-
-            if current_time < timeout_end:
-                remaining = int(timeout_end - current_time)
-                minutes = remaining // 60
-                seconds = remaining % 60
-
-                await interaction.response.send_message(
-                    f"A timeout is currently in effect. Please attempt verification again in {minutes}m {seconds}s.",
-                    ephemeral=True
-                )
-                return
-            else:
-                del self.timeouts[user_id]
+        remaining = int(self.lockouts.remaining(guild_id, user_id))
+        if remaining > 0:
+            minutes = remaining // 60
+            seconds = remaining % 60
+
+            await self.pipeline.send(
+                interaction,
+                content=f"A timeout is currently in effect. Please attempt verification again in {minutes}m {seconds}s."
+            )
+            return
+        trace.mark("checks")
 
-        # Generate a captcha
-        captcha_file, solution = await self.create_captcha()
-        self.active_captchas[user_id] = solution
+        # Generate a captcha, deferring the click if it isn't ready in time
+        captcha_file, solution = await self.pipeline.run(interaction, trace, self.create_captcha(guild_id), "render")
 
         captcha_embed = discord.Embed(
             title="🔒 Verification Required",
             description="Please complete the captcha verification below",
             color=discord.Color.blue()
         )
-        captcha_embed.set_image(url="attachment://captcha.png")
+        captcha_embed.set_image(url=f"attachment://{captcha_file.filename}")
 
-        captcha_view = self.CaptchaView(
-            self,
-            solution,
-            user_id,
-            guild_id
-        )
+        captcha_view = self.start_challenge(guild_id, user_id, solution)
 
-        await interaction.response.send_message(
+        await self.pipeline.send(
+            interaction,
             embed=captcha_embed,
             file=captcha_file,
-            view=captcha_view,
-            ephemeral=True
+            view=captcha_view
         )
+        trace.mark("respond")
 
     def is_verified(self, user_id: int, guild_id: int) -> bool:
-        db_filename = self.config["verification_settings"]["db_filename"]
-        conn = sqlite3.connect(db_filename)
-        cursor = conn.cursor()
-
-        cursor.execute(
-            "SELECT 1 FROM verified_users WHERE user_id = ? AND guild_id = ?",
-            (user_id, guild_id)
-        )
-
-        result = cursor.fetchone() is not None
-        conn.close()
-
-        return result
+        return self.db.is_verified(user_id, guild_id)
 
     def mark_as_verified(self, user_id: int, guild_id: int):
-        db_filename = self.config["verification_settings"]["db_filename"]
-        conn = sqlite3.connect(db_filename)
-        cursor = conn.cursor()
-
-        cursor.execute(
-            "INSERT OR REPLACE INTO verified_users (user_id, guild_id) VALUES (?, ?)",
-            (user_id, guild_id)
-        )
-
-        conn.commit()
-        conn.close()
+        self.db.mark_as_verified(user_id, guild_id)
 
     def store_button(self, button_id: str, message_id: int, channel_id: int, guild_id: int):
-        db_filename = self.config["verification_settings"]["db_filename"]
-        conn = sqlite3.connect(db_filename)
-        cursor = conn.cursor()
-
-        cursor.execute(
-            "INSERT INTO active_buttons (button_id, message_id, channel_id, guild_id) VALUES (?, ?, ?, ?)",
-            (button_id, message_id, channel_id, guild_id)
-        )
-
-        conn.commit()
-        conn.close()
+        self.db.store_button(button_id, message_id, channel_id, guild_id)
 
     def remove_button(self, button_id: str):
-        db_filename = self.config["verification_settings"]["db_filename"]
-        conn = sqlite3.connect(db_filename)
-        cursor = conn.cursor()
-
-        cursor.execute("DELETE FROM active_buttons WHERE button_id = ?", (button_id,))
-
-        conn.commit()
-        conn.close()
+        self.db.remove_button(button_id)
+
+    def start_challenge(self, guild_id: int, user_id: int, solution: str) -> discord.ui.View:
+        """Remember a new captcha for the user and build the view with its "Enter Captcha" button.
+
+        The view only holds a dynamic item, so discord.py doesn't store it after
+        the message is sent and a click is routed by the button's custom_id.
+        """
+        self.db.record_event(guild_id, user_id, EVENT_ISSUED)
+        view = discord.ui.View(timeout=None)
+        if self.signer:
+            view.add_item(self.SignedCaptchaButton(self.signer.issue(guild_id, user_id, solution)))
+        else:
+            nonce = self.state.set_solution(guild_id, user_id, solution)
+            view.add_item(self.CaptchaButton(guild_id, user_id, nonce))
+        return view
+
+    def check_answer(self, guild_id: int, user_id: int, answer: str,
+                     solution: Optional[str] = None, token: Optional[str] = None) -> bool:
+        if token is not None:
+            return self.signer is not None and self.signer.check(token, guild_id, user_id, answer)
+        return answer.strip().upper() == solution.strip().upper()
+
+    def lock_out(self, guild_id: int, user_id: int):
+        """Put the user in timeout after too many failed attempts"""
+        timeout_seconds = self.attempt_limits(guild_id)[1] * 60
+        expires_at = self.lockouts.lock_out(guild_id, user_id, timeout_seconds)
+        self.metrics.lockouts.inc()
+        self.db.record_event(guild_id, user_id, EVENT_LOCKED_OUT)
+
+        if self.config.persist_lockouts:
+            self.db.store_lockout(guild_id, user_id, expires_at)
+
+    def _end_lockouts(self, keys: List[Tuple[int, int]]):
+        """Called by the lockout scheduler with every timeout that just ended"""
+        for guild_id, user_id in keys:
+            self.state.clear(guild_id, user_id)
+
+        if self.config.persist_lockouts:
+            self.db.remove_lockouts(keys)
+
+    def _observe_render(self, seconds: float, image_bytes: int):
+        self.metrics.render_seconds.observe(seconds)
+        self.metrics.image_bytes.observe(image_bytes)
+
+    async def flush_pending_writes(self):
+        """Write queued verifications and button changes to the database now"""
+        await self.db.flush()
 
     def generate_captcha_text(self) -> str:
         """Generate random captcha text"""
-        uppercase_letters = "ABCDEFGHJKLMNPQRSTUVWXYZ"
-        digits = "23456789"
-
-        characters = uppercase_letters + digits
-        captcha_length = self.config["captcha_settings"]["length"]
-        captcha_text = ''.join(random.choice(characters) for _ in range(captcha_length))
+        captcha_length = self.config.captcha_length
+        captcha_text = ''.join(random.choice(CAPTCHA_ALPHABET) for _ in range(captcha_length))
 
         return captcha_text
 
     def generate_captcha_image(self, text: str) -> io.BytesIO:
         """Generate a captcha image with the given text"""
-        width = self.config["captcha_settings"]["width"]
-        height = self.config["captcha_settings"]["height"]
-
-        image = Image.new('RGB', (width, height), color=(255, 255, 255))
-        draw = ImageDraw.Draw(image)
-
-        try:
-            font = ImageFont.truetype(self.config["captcha_settings"]["font_path"],
-                                      self.config["captcha_settings"]["font_size"])
-        except Exception as e:
-            print(f"Error loading font: {e}")
-            font = ImageFont.load_default()
-
-        text_bbox = draw.textbbox((0, 0), text, font=font) if hasattr(draw, 'textbbox') else font.getbbox(text)
-        text_width = text_bbox[2] - text_bbox[0]
-        text_height = text_bbox[3] - text_bbox[1]
-        text_x = (width - text_width) // 2
-        text_y = (height - text_height) // 2
-
-        for _ in range(width * height // 20):
-            x = random.randint(0, width - 1)
-            y = random.randint(0, height - 1)
-            draw.point((x, y), fill=(random.randint(0, 200), random.randint(0, 200), random.randint(0, 200)))
-
-        for _ in range(8):
-            x1 = random.randint(0, width - 1)
-            y1 = random.randint(0, height - 1)
-            x2 = random.randint(0, width - 1)
-            y2 = random.randint(0, height - 1)
-            draw.line([(x1, y1), (x2, y2)],
-                      fill=(random.randint(0, 200), random.randint(0, 200), random.randint(0, 200)), width=1)
-
-        for i, char in enumerate(text):
-            char_x = text_x + i * (text_width // len(text))
-            char_y = text_y + random.randint(-10, 10)
-
-            char_img = Image.new('RGBA', (text_width // len(text) + 10, text_height + 20), (255, 255, 255, 0))
-            char_draw = ImageDraw.Draw(char_img)
-            char_draw.text((5, 10), char, font=font, fill=(0, 0, 0))
-
-            rotation = random.uniform(-25, 25)
-            char_img = char_img.rotate(rotation, expand=True, fillcolor=(255, 255, 255, 0), resample=Image.BICUBIC)
-
-            image.paste(char_img, (char_x, char_y), char_img)
-
-        image = image.filter(ImageFilter.GaussianBlur(radius=0.5))
-
-        byte_array = io.BytesIO()
-        image.save(byte_array, format='PNG')
+        byte_array = io.BytesIO(render_captcha(text, self.config.captcha))
         byte_array.seek(0)
 
         return byte_array
 
-    async def create_captcha(self) -> Tuple[discord.File, str]:
-        # Generate random captcha text
-        captcha_text = self.generate_captcha_text()
-
-        # Generate captcha image
-        captcha_image = self.generate_captcha_image(captcha_text)
+    async def create_captcha(self, guild_id: Optional[int] = None) -> Tuple[discord.File, str]:
+        raided = self.raid is not None and self.raid.is_active(guild_id)
+        if guild_id is None:
+            settings = self.config.raid_captcha if raided else self.config.captcha
+            use_pool = True
+        else:
+            guild_config = self.guild_configs.get(guild_id)
+            settings = guild_config.raid_captcha if raided else guild_config.captcha
+            # The pool holds captchas with the config's warp, during a raid they are good enough for everyone
+            use_pool = raided or not guild_config.custom_captcha
+
+        # Serve a pre-rendered captcha if the pool has one ready
+        pooled = self.captcha_pool.take() if self.captcha_pool and use_pool else None
+
+        if pooled:
+            captcha_text, image_bytes = pooled
+        else:
+            # Generate random captcha text
+            captcha_text = self.generate_captcha_text()
+
+            # Render the image off the event loop so slow renders don't stall other interactions
+            image_bytes = await self.renderer.render(captcha_text, settings)
 
         # Create Discord file
-        captcha_file = discord.File(captcha_image, filename="captcha.png")
+        captcha_file = discord.File(io.BytesIO(image_bytes), filename=self.config.captcha_filename)
 
         return captcha_file, captcha_text
 
     class CaptchaModal(discord.ui.Modal):
-        def __init__(self, cog, solution: str, user_id: int, guild_id: int):
-            super().__init__(title="Captcha Verification")
+        """The answer form, the solution is looked up on submit so the modal holds no challenge state"""
+
+        def __init__(self, cog, user_id: int, guild_id: int, token: Optional[str] = None,
+                     nonce: Optional[str] = None):
+            # A dismissed modal is never submitted, the timeout removes it from discord.py's modal store
+            super().__init__(title="Captcha Verification", timeout=cog.config.challenge_ttl)
             self.cog = cog
-            self.solution = solution
+            self.token = token
+            self.nonce = nonce
             self.user_id = user_id
             self.guild_id = guild_id
 
@@ -323,142 +497,231 @@ class CaptchaVerification(commands.Cog):
             )
             self.add_item(self.answer)
 
+        @instrument_interaction("modal_submit")
         async def on_submit(self, interaction: discord.Interaction):
-            if self.answer.value.strip().upper() == self.solution.strip().upper():
+            pipeline = self.cog.pipeline
+            trace = pipeline.trace("modal_submit")
+            guild_config = self.cog.guild_configs.get(self.guild_id)
+            max_attempts, timeout_minutes = self.cog.attempt_limits(self.guild_id)
+            challenge = None if self.token else self.cog.state.get_challenge(self.guild_id, self.user_id)
+
+            if self.token is None and challenge is None:
+                await pipeline.send(interaction, content="This captcha has expired. Please start the verification again.")
+                return
+
+            if challenge is not None and challenge[0] != self.nonce:
+                await pipeline.send(
+                    interaction,
+                    content="This captcha has expired because you were sent a newer one. Please use the newest captcha."
+                )
+                return
+            solution = challenge[1] if challenge else None
+
+            if self.cog.check_answer(self.guild_id, self.user_id, self.answer.value, solution, self.token):
                 guild = interaction.guild
-                role = guild.get_role(self.cog.config["verified_role_id"])
+                role = guild.get_role(guild_config.verified_role_id)
 
                 if role:
+                    trace.mark("checks")
                     try:
-                        await interaction.user.add_roles(role)
+                        await pipeline.run(interaction, trace, interaction.user.add_roles(role), "add_role",
+                                           thinking=False)
                         self.cog.mark_as_verified(self.user_id, self.guild_id)
+                        self.cog.metrics.verifications.inc()
+                        self.cog.db.record_event(self.guild_id, self.user_id, EVENT_SOLVED)
 
                         success_embed = discord.Embed(
                             title="✅ Verification Successful",
-                            description=self.cog.config["messages"]["verification_success"],
+                            description=guild_config.success_message,
                             color=discord.Color.green()
                         )
 
-                        await interaction.response.edit_message(
+                        await pipeline.edit(
+                            interaction,
                             embed=success_embed,
                             view=None,
                             attachments=[]
                         )
+                        trace.mark("respond")
 
-                        if self.user_id in self.cog.active_captchas:
-                            del self.cog.active_captchas[self.user_id]
-                        if self.user_id in self.cog.user_attempts:
-                            del self.cog.user_attempts[self.user_id]
+                        self.cog.state.clear(self.guild_id, self.user_id)
 
                     except discord.Forbidden:
-                        await interaction.response.send_message(
-                            "Insufficient permissions to assign roles. Please contact an administrator for assistance.",
-                            ephemeral=True
+                        await pipeline.send(
+                            interaction,
+                            content="Insufficient permissions to assign roles. Please contact an administrator for assistance."
                         )
                 else:
-                    await interaction.response.send_message(
-                        "Verification role not found in configuration. Please contact an administrator for assistance.",
-                        ephemeral=True
+                    await pipeline.send(
+                        interaction,
+                        content="Verification role not found in configuration. Please contact an administrator for assistance."
                     )
             else:
-                if self.user_id not in self.cog.user_attempts:
-                    self.cog.user_attempts[self.user_id] = 1
-                else:
-                    self.cog.user_attempts[self.user_id] += 1
-
-                attempts = self.cog.user_attempts[self.user_id]
+                attempts = self.cog.state.record_failure(self.guild_id, self.user_id)
+                self.cog.metrics.failures.inc()
+                self.cog.db.record_event(self.guild_id, self.user_id, EVENT_FAILED)
 
-                if attempts >= self.cog.config["verification_settings"]["max_attempts"]:
-                    timeout_end = asyncio.get_event_loop().time() + (
-                                self.cog.config["verification_settings"]["timeout_minutes"] * 60)
-                    self.cog.timeouts[self.user_id] = timeout_end
+                if attempts >= max_attempts:
+                    self.cog.lock_out(self.guild_id, self.user_id)
 
                     timeout_embed = discord.Embed(
                         title="⛔ Verification Limit Reached",
-                        description=self.cog.config["messages"]["verification_timeout"],
+                        description=guild_config.timeout_message,
                         color=discord.Color.red()
                     )
                     timeout_embed.add_field(
                         name="Timeout Period",
-                        value=f"You may attempt verification again in {self.cog.config['verification_settings']['timeout_minutes']} minutes."
+                        value=f"You may attempt verification again in {timeout_minutes} minutes."
                     )
 
-                    await interaction.response.edit_message(
+                    await pipeline.edit(
+                        interaction,
                         embed=timeout_embed,
                         view=None,
                         attachments=[]
                     )
-
-                    await asyncio.sleep(self.cog.config["verification_settings"]["timeout_minutes"] * 60)
-                    if self.user_id in self.cog.user_attempts:
-                        del self.cog.user_attempts[self.user_id]
-                    if self.user_id in self.cog.timeouts:
-                        del self.cog.timeouts[self.user_id]
                 else:
-                    new_captcha_file, new_solution = await self.cog.create_captcha()
-                    self.cog.active_captchas[self.user_id] = new_solution
+                    trace.mark("checks")
+                    new_captcha_file, new_solution = await pipeline.run(
+                        interaction, trace, self.cog.create_captcha(self.guild_id), "render", thinking=False
+                    )
 
                     failed_embed = discord.Embed(
                         title="❌ Verification Unsuccessful",
-                        description=self.cog.config["messages"]["verification_failed"],
+                        description=guild_config.failed_message,
                         color=discord.Color.red()
                     )
                     failed_embed.add_field(
                         name="Attempts",
-                        value=f"{attempts}/{self.cog.config['verification_settings']['max_attempts']}"
+                        value=f"{attempts}/{max_attempts}"
                     )
-                    failed_embed.set_image(url="attachment://captcha.png")
+                    failed_embed.set_image(url=f"attachment://{new_captcha_file.filename}")
 
-                    view = CaptchaVerification.CaptchaView(
-                        self.cog,
-                        new_solution,
-                        self.user_id,
-                        self.guild_id
-                    )
+                    view = self.cog.start_challenge(self.guild_id, self.user_id, new_solution)
 
-                    await interaction.response.edit_message(
+                    await pipeline.edit(
+                        interaction,
                         embed=failed_embed,
                         view=view,
                         attachments=[new_captcha_file]
                     )
-
-    class CaptchaView(discord.ui.View):
-        def __init__(self, cog, solution: str, user_id: int, guild_id: int):
-            super().__init__(timeout=None)
-            self.cog = cog
-            self.solution = solution
-            self.user_id = user_id
+                    trace.mark("respond")
+
+    class CaptchaButton(discord.ui.DynamicItem[discord.ui.Button],
+                        template=r"cv:(?P<guild_id>[0-9]+):(?P<user_id>[0-9]+):(?P<nonce>[0-9a-f]+)"):
+        """"Enter Captcha" button of a challenge kept in the cog's state, routed by guild and user.
+
+        The nonce identifies the captcha the button was sent with, so the button
+        of an older captcha can't be used to answer the newest one.
+        """
+
+        def __init__(self, guild_id: int, user_id: int, nonce: str):
+            super().__init__(
+                discord.ui.Button(
+                    label="Enter Captcha",
+                    emoji="<:captcha:1353308565061767259>",
+                    style=discord.ButtonStyle.primary,
+                    custom_id=f"cv:{guild_id}:{user_id}:{nonce}"
+                )
+            )
             self.guild_id = guild_id
+            self.user_id = user_id
+            self.nonce = nonce
 
-            self.button_id = f"captcha_{user_id}_{random.randint(1000, 9999)}"
-        custom_emoji = "<:captcha:1353308565061767259>"
-        @discord.ui.button(label="Enter Captcha",emoji=custom_emoji , style=discord.ButtonStyle.primary, custom_id="captcha_button")
-        async def captcha_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-            if self.user_id in self.cog.timeouts:
-                timeout_end = self.cog.timeouts[self.user_id]
-                current_time = asyncio.get_event_loop().time()
-
-                if current_time < timeout_end:
-                    remaining = int(timeout_end - current_time)
-                    minutes = remaining // 60
-                    seconds = remaining % 60
-
-                    await interaction.response.send_message(
-                        f"A timeout period is currently active. Please attempt verification again in {minutes}m {seconds}s.",
-                        ephemeral=True
-                    )
-                    return
-                else:
-                    del self.cog.timeouts[self.user_id]
-
-            # Open the modal
-            modal = CaptchaVerification.CaptchaModal(
-                self.cog,
-                self.solution,
-                self.user_id,
-                self.guild_id
+        @classmethod
+        async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+            return cls(int(match["guild_id"]), int(match["user_id"]), match["nonce"])
+
+        @instrument_interaction("captcha_button")
+        async def callback(self, interaction: discord.Interaction):
+            cog = interaction.client.get_cog("CaptchaVerification")
+
+            if cog is None or (self.guild_id, self.user_id) != (interaction.guild.id, interaction.user.id):
+                await interaction.response.send_message(
+                    "This captcha is not valid. Please start the verification again.",
+                    ephemeral=True
+                )
+                return
+
+            remaining = int(cog.lockouts.remaining(self.guild_id, self.user_id))
+            if remaining > 0:
+                minutes = remaining // 60
+                seconds = remaining % 60
+
+                await interaction.response.send_message(
+                    f"A timeout period is currently active. Please attempt verification again in {minutes}m {seconds}s.",
+                    ephemeral=True
+                )
+                return
+
+            challenge = cog.state.get_challenge(self.guild_id, self.user_id)
+            if challenge is None:
+                await interaction.response.send_message(
+                    "This captcha has expired. Please start the verification again.",
+                    ephemeral=True
+                )
+                return
+
+            if challenge[0] != self.nonce:
+                await interaction.response.send_message(
+                    "This captcha has expired because you were sent a newer one. Please use the newest captcha.",
+                    ephemeral=True
+                )
+                return
+
+            modal = CaptchaVerification.CaptchaModal(cog, self.user_id, self.guild_id, nonce=self.nonce)
+            await interaction.response.send_modal(modal)
+
+    class SignedCaptchaButton(discord.ui.DynamicItem[discord.ui.Button], template=r"cvs:(?P<token>[A-Za-z0-9_-]+)"):
+        """"Enter Captcha" button for stateless challenges, the signed challenge is its custom_id"""
+
+        def __init__(self, token: str):
+            super().__init__(
+                discord.ui.Button(
+                    label="Enter Captcha",
+                    emoji="<:captcha:1353308565061767259>",
+                    style=discord.ButtonStyle.primary,
+                    custom_id=f"cvs:{token}"
+                )
             )
+            self.token = token
 
+        @classmethod
+        async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+            return cls(match["token"])
+
+        @instrument_interaction("captcha_button")
+        async def callback(self, interaction: discord.Interaction):
+            cog = interaction.client.get_cog("CaptchaVerification")
+            decoded = cog.signer.decode(self.token) if cog and cog.signer else None
+
+            if decoded is None or decoded[:2] != (interaction.guild.id, interaction.user.id):
+                await interaction.response.send_message(
+                    "This captcha is not valid. Please start the verification again.",
+                    ephemeral=True
+                )
+                return
+
+            guild_id, user_id, _ = decoded
+            remaining = int(cog.lockouts.remaining(guild_id, user_id))
+            if remaining > 0:
+                minutes = remaining // 60
+                seconds = remaining % 60
+
+                await interaction.response.send_message(
+                    f"A timeout period is currently active. Please attempt verification again in {minutes}m {seconds}s.",
+                    ephemeral=True
+                )
+                return
+
+            if cog.signer.is_expired(self.token):
+                await interaction.response.send_message(
+                    "This captcha has expired. Please start the verification again.",
+                    ephemeral=True
+                )
+                return
+
+            modal = CaptchaVerification.CaptchaModal(cog, user_id, guild_id, token=self.token)
             await interaction.response.send_modal(modal)
 
     @commands.command()
@@ -490,202 +753,362 @@ This message can be customized to better suit your community's requirements.
             icon_url="https://cdn.discordapp.com/attachments/1351096159510204456/1353315601682272276/lock.png?ex=67e134de&is=67dfe35e&hm=58e86acf0ceb66f2a8f986f4d02c6a740c4232b60847df8dbf3def4434e1f782&",
         )
 
-        class VerificationView(discord.ui.View):
-            def __init__(self, cog):
-                super().__init__(timeout=None)
-                self.cog = cog
+        view = VerificationView()
+        message = await ctx.send(embed=embed, view=view)
 
-                self.button_id = f"verify_{random.randint(1000, 9999)}"
+        self.store_button(
+            view.button_id,
+            message.id,
+            ctx.channel.id,
+            ctx.guild.id
+        )
 
-            custom_emoji = "<:verify:1353299720373669939>"
-            @discord.ui.button(label="Verify", style=discord.ButtonStyle.green, emoji=custom_emoji, custom_id="verify_button")
-            async def verify_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-                user_id = interaction.user.id
-                guild_id = interaction.guild.id
+        await ctx.message.delete()
 
-                if self.cog.is_verified(user_id, guild_id):
-                    already_verified_embed = discord.Embed(
-                        title="✅ Verification Status",
-                        description=self.cog.config["messages"]["already_verified"],
-                        color=discord.Color.green()
-                    )
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def captcha_stats(self, ctx):
+        """Show captcha rendering statistics"""
+        embed = discord.Embed(
+            title="📊 Captcha Statistics",
+            color=discord.Color.blue()
+        )
 
-                    await interaction.response.send_message(
-                        embed=already_verified_embed,
-                        ephemeral=True
-                    )
-                    return
+        render_stats = self.renderer.stats()
+        embed.add_field(
+            name="Rendering",
+            value="\n".join(f"`{key}`: {value}" for key, value in render_stats.items()),
+            inline=False
+        )
 
-                if user_id in self.cog.timeouts:
-                    timeout_end = self.cog.timeouts[user_id]
-                    current_time = asyncio.get_event_loop().time()
+        if self.captcha_pool:
+            pool_stats = self.captcha_pool.stats()
+            embed.add_field(
+                name="Captcha Pool",
+                value="\n".join(f"`{key}`: {value}" for key, value in pool_stats.items()),
+                inline=False
+            )
 
-                    if current_time < timeout_end:
-                        remaining = int(timeout_end - current_time)
-                        minutes = remaining // 60
-                        seconds = remaining % 60
+        if self.raid:
+            raiding, rates = self.raid.rates(ctx.guild.id)
+            raid_stats = {**self.raid.stats(), "this_server": "raid mode" if raiding else "normal", **rates}
+            embed.add_field(
+                name="Raid Mode",
+                value="\n".join(f"`{key}`: {value}" for key, value in raid_stats.items()),
+                inline=False
+            )
 
-                        await interaction.response.send_message(
-                            f"A timeout period is currently active. Please attempt verification again in {minutes}m {seconds}s.",
-                            ephemeral=True
-                        )
-                        return
-                    else:
-                        del self.cog.timeouts[user_id]
+        embed.add_field(
+            name="Interactions",
+            value="\n".join(f"`{key}`: {value}" for key, value in self.pipeline.stats().items()),
+            inline=False
+        )
 
-                captcha_file, solution = await self.cog.create_captcha()
-                self.cog.active_captchas[user_id] = solution
+        state_stats = {**self.state.stats(), **self.lockouts.stats()}
+        embed.add_field(
+            name="Verification State",
+            value="\n".join(f"`{key}`: {value}" for key, value in state_stats.items()),
+            inline=False
+        )
 
-                captcha_embed = discord.Embed(
-                    title="🔒 Verification Required",
-                    description="Please complete the captcha verification below",
-                    color=discord.Color.blue()
-                )
-                captcha_embed.set_image(url="attachment://captcha.png")
+        db_stats = {
+            **self.db.stats(),
+            "buttons_restored": self.buttons_restored,
+            "buttons_pruned": self.buttons_pruned,
+            "restore_seconds": round(self.restore_seconds, 2),
+        }
+        embed.add_field(
+            name="Database",
+            value="\n".join(f"`{key}`: {value}" for key, value in db_stats.items()),
+            inline=False
+        )
 
-                captcha_view = CaptchaVerification.CaptchaView(
-                    self.cog,
-                    solution,
-                    user_id,
-                    guild_id
-                )
+        if self.retention:
+            embed.add_field(
+                name="Retention",
+                value="\n".join(f"`{key}`: {value}" for key, value in (await self.retention.stats()).items()),
+                inline=False
+            )
 
-                await interaction.response.send_message(
-                    embed=captcha_embed,
-                    file=captcha_file,
-                    view=captcha_view,
-                    ephemeral=True
+        await ctx.send(embed=embed)
+
+    @app_commands.command(name="verification_stats")
+    @app_commands.describe(period="Time span to summarize")
+    @app_commands.choices(period=[
+        app_commands.Choice(name="Last hour", value=3600),
+        app_commands.Choice(name="Last 24 hours", value=86400),
+        app_commands.Choice(name="Last 7 days", value=7 * 86400),
+    ])
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    async def verification_stats(self, interaction: discord.Interaction, period: int = 86400):
+        """Show how many captchas were issued, solved and failed on this server"""
+        counts = await self.db.event_counts(interaction.guild_id, period)
+
+        totals = {event: 0 for event in EVENT_NAMES}
+        for bucket_counts in counts.values():
+            for event, count in bucket_counts.items():
+                totals[event] = totals.get(event, 0) + count
+
+        answered = totals[EVENT_SOLVED] + totals[EVENT_FAILED]
+        hours = period // 3600
+        embed = discord.Embed(
+            title="📈 Verification Statistics",
+            description=f"Last {hours} hour{'s' if hours != 1 else ''}",
+            color=discord.Color.blue()
+        )
+        embed.add_field(
+            name="Events",
+            value="\n".join(f"`{EVENT_NAMES[event]}`: {count}" for event, count in totals.items()),
+            inline=False
+        )
+        rates = {
+            "solved_per_issued": f"{totals[EVENT_SOLVED] / totals[EVENT_ISSUED]:.1%}" if totals[EVENT_ISSUED] else "-",
+            "failed_answers": f"{totals[EVENT_FAILED] / answered:.1%}" if answered else "-",
+        }
+        embed.add_field(
+            name="Rates",
+            value="\n".join(f"`{key}`: {value}" for key, value in rates.items()),
+            inline=False
+        )
+        if counts:
+            peak_start, peak_counts = max(counts.items(), key=lambda item: item[1].get(EVENT_ISSUED, 0))
+            if peak_counts.get(EVENT_ISSUED):
+                embed.add_field(
+                    name="Busiest " + ("minute" if period <= 3 * 3600 else "hour"),
+                    value=f"<t:{peak_start}:f>, {peak_counts[EVENT_ISSUED]} captchas issued",
+                    inline=False
                 )
 
-        view = VerificationView(self)
-        message = await ctx.send(embed=embed, view=view)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
-        self.store_button(
-            view.button_id,
-            message.id,
-            ctx.channel.id,
-            ctx.guild.id
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def verify_settings(self, ctx):
+        """Show the verification settings in effect for this server"""
+        overrides = self.guild_configs.overrides.get(ctx.guild.id, {})
+        guild_config = self.guild_configs.get(ctx.guild.id)
+
+        embed = discord.Embed(
+            title="⚙️ Verification Settings",
+            color=discord.Color.blue()
         )
+        for key, value in guild_config.as_dict().items():
+            if key == "verified_role_id":
+                value = f"<@&{value}> ({value})"
+            embed.add_field(
+                name=f"{key} (server)" if key in overrides else key,
+                value=str(value)[:1024],
+                inline=False
+            )
+        embed.set_footer(text="Change with !verify_set <setting> <value>, undo with !verify_reset [setting]")
 
-        await ctx.message.delete()
+        await ctx.send(embed=embed)
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        """Load all active buttons from the database when the bot starts"""
-        print(f"{self.__class__.__name__} cog is ready!")
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def verify_set(self, ctx, key: str, *, value: str):
+        """Override a verification setting for this server"""
+        try:
+            parsed = GuildConfigCache.parse(key, value)
+        except ValueError as e:
+            await ctx.send(str(e))
+            return
 
-        db_filename = self.config["verification_settings"]["db_filename"]
-        conn = sqlite3.connect(db_filename)
-        cursor = conn.cursor()
+        if key == "verified_role_id" and ctx.guild.get_role(parsed) is None:
+            await ctx.send(f"No role with the id {parsed} exists on this server.")
+            return
 
-        cursor.execute("SELECT button_id, message_id, channel_id, guild_id FROM active_buttons")
-        buttons = cursor.fetchall()
+        await self.db.set_guild_setting(ctx.guild.id, key, parsed)
+        self.guild_configs.set_override(ctx.guild.id, key, parsed)
+        await ctx.send(f"`{key}` is now set to `{parsed}` for this server.")
 
-        conn.close()
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def verify_reset(self, ctx, key: Optional[str] = None):
+        """Remove one or all of this server's overrides so the config file applies again"""
+        if key is not None and key not in GUILD_SETTINGS:
+            await ctx.send(f"Unknown setting `{key}`, available: {', '.join(GUILD_SETTINGS)}")
+            return
 
-        print(f"Loading {len(buttons)} verification buttons...")
+        removed = self.guild_configs.clear_overrides(ctx.guild.id, key)
+        if not removed:
+            await ctx.send("This server has no overrides to remove.")
+            return
 
-        for button_id, message_id, channel_id, guild_id in buttons:
-            try:
-                channel = self.bot.get_channel(channel_id)
-                if not channel:
-                    channel = await self.bot.fetch_channel(channel_id)
+        await self.db.delete_guild_settings(ctx.guild.id, removed)
+        await ctx.send(f"Removed the server override of {', '.join(f'`{name}`' for name in removed)}.")
 
-                if channel:
-                    try:
-                        message = await channel.fetch_message(message_id)
+    @commands.command()
+    @commands.is_owner()
+    async def reload_verify_config(self, ctx):
+        """Apply changes to verify_config.json without restarting"""
+        if await self.reload_config():
+            await ctx.send("Reloaded `verify_config.json`.")
+        else:
+            await ctx.send("`verify_config.json` couldn't be read, the previous configuration is still in use.")
 
-                        if "verify_" in button_id:
-                            class PersistentVerificationView(discord.ui.View):
-                                def __init__(self, cog):
-                                    super().__init__(timeout=None)
-                                    self.cog = cog
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def reconcile_verification(self, ctx, source: str = "db", mode: str = "preview"):
+        """Compare the verified role with the stored verifications and fix differences.
+
+        ``source`` is what to trust: ``db`` fixes the roles, ``roles`` fixes the
+        database. Nothing is changed unless ``mode`` is ``apply``.
+        """
+        if source not in RECONCILE_SOURCES or mode not in ("preview", "apply"):
+            await ctx.send("Usage: `!reconcile_verification [db|roles] [preview|apply]`")
+            return
 
-                                custom_emoji = "<:verify:1353299720373669939>"
-                                @discord.ui.button(label="Verify", style=discord.ButtonStyle.green, emoji=custom_emoji,
-                                                   custom_id="verify_button")
-                                async def verify_button(self, interaction: discord.Interaction,
-                                                        button: discord.ui.Button):
-                                    await self.cog.handle_verification_button(interaction)
+        if ctx.guild.id in self._reconciling:
+            await ctx.send("A reconciliation is already running for this server.")
+            return
 
-                            self.bot.add_view(PersistentVerificationView(self))
+        reconcile_settings = self.config.section("reconcile")
+        reconciler = RoleReconciler(
+            self.bot.http,
+            self.db,
+            ctx.guild.id,
+            self.guild_configs.get(ctx.guild.id).verified_role_id,
+            source=source,
+            apply=mode == "apply",
+            requests_per_second=reconcile_settings["requests_per_second"],
+            workers=reconcile_settings["workers"],
+            reason=f"Verification reconciliation by {ctx.author}"
+        )
 
-                    except discord.NotFound:
-                        self.remove_button(button_id)
+        def progress_embed(title: str, color: discord.Color) -> discord.Embed:
+            embed = discord.Embed(title=title, color=color)
+            embed.description = "\n".join(f"`{key}`: {value}" for key, value in reconciler.progress().items())
+            embed.set_footer(text=f"Source: {source}, mode: {mode}")
+            return embed
 
-                    except Exception as e:
-                        print(f"Error loading button {button_id}: {e}")
+        self._reconciling[ctx.guild.id] = reconciler
+        message = await ctx.send(embed=progress_embed("🔄 Reconciling Verifications", discord.Color.blue()))
+        task = asyncio.create_task(reconciler.run())
 
-            except Exception as e:
-                print(f"Error processing button {button_id}: {e}")
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=reconcile_settings["progress_seconds"])
+                if not task.done():
+                    try:
+                        await message.edit(embed=progress_embed("🔄 Reconciling Verifications", discord.Color.blue()))
+                    except discord.HTTPException:
+                        pass
+            await task
+        finally:
+            del self._reconciling[ctx.guild.id]
+
+        await self.flush_pending_writes()
+
+        if reconciler.error:
+            embed = progress_embed("⚠️ Reconciliation Failed", discord.Color.red())
+            embed.add_field(name="Error", value=reconciler.error, inline=False)
+            await message.edit(embed=embed)
+        else:
+            await message.edit(embed=progress_embed("✅ Reconciliation Finished", discord.Color.green()))
 
+    @commands.Cog.listener()
+    async def on_ready(self):
+        """Check the stored verification messages once the bot is connected and drop deleted ones"""
+        print(f"{self.__class__.__name__} cog is ready!")
 
-class VerificationView(discord.ui.View):
-    def __init__(self, cog):
-        super().__init__(timeout=None)
-        self.cog = cog
+        # on_ready fires again after reconnects, the buttons only need checking once
+        if self._buttons_checked:
+            return
+        self._buttons_checked = True
 
-        self.button_id = f"verify_{random.randint(1000, 9999)}"
+        start = time.perf_counter()
+        buttons = await self.db.fetch_buttons()
 
-    custom_emoji = "<:verify:1353299720373669939>"
-    @discord.ui.button(label="Verify", style=discord.ButtonStyle.green, emoji=custom_emoji, custom_id="verify_button")
-    async def verify_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        user_id = interaction.user.id
-        guild_id = interaction.guild.id
+        # Only check guilds this bot (or shard group) can see, messages in the same
+        # channel share a rate limit bucket so they are checked one after another
+        by_channel: Dict[int, List[Tuple[str, int]]] = {}
+        for button_id, message_id, channel_id, guild_id in buttons:
+            if self.bot.get_guild(guild_id) is not None:
+                by_channel.setdefault(channel_id, []).append((button_id, message_id))
+
+        checked = sum(len(rows) for rows in by_channel.values())
+        print(f"Checking {checked} verification buttons in {len(by_channel)} channels...")
+
+        semaphore = asyncio.Semaphore(self.config.restore_concurrency)
+        dead_buttons: List[str] = []
+
+        async def check_channel(channel_id: int, rows: List[Tuple[str, int]]):
+            async with semaphore:
+                try:
+                    channel = self.bot.get_channel(channel_id)
+                    if not channel:
+                        channel = await self.bot.fetch_channel(channel_id)
+                except discord.NotFound:
+                    dead_buttons.extend(button_id for button_id, _ in rows)
+                    return
+                except Exception as e:
+                    print(f"Error processing channel {channel_id}: {e}")
+                    return
 
-        if self.cog.is_verified(user_id, guild_id):
-            already_verified_embed = discord.Embed(
-                title="✅ Verification Status",
-                description=self.cog.config["messages"]["already_verified"],
-                color=discord.Color.green()
-            )
+                for button_id, message_id in rows:
+                    try:
+                        await channel.fetch_message(message_id)
+                    except discord.NotFound:
+                        dead_buttons.append(button_id)
+                    except Exception as e:
+                        print(f"Error loading button {button_id}: {e}")
 
-            await interaction.response.send_message(
-                embed=already_verified_embed,
-                ephemeral=True
+        await asyncio.gather(*(check_channel(channel_id, rows) for channel_id, rows in by_channel.items()))
+
+        if dead_buttons:
+            self.db.remove_buttons(dead_buttons)
+            await self.db.flush()
+
+        # Every guild is in the cache after the first on_ready, unavailable ones included
+        if self.retention:
+            stored_guilds = [guild_id for _, _, _, guild_id in buttons]
+            stored_guilds += list(self.db.verified) + list(self.guild_configs.overrides)
+            departed = self._departed_guilds(stored_guilds)
+            for guild_id in departed:
+                self.forget_guild(guild_id)
+            if departed:
+                print(f"Deleting the stored data of {len(departed)} servers the bot was removed from")
+
+        self.buttons_restored = checked - len(dead_buttons)
+        self.buttons_pruned = len(dead_buttons)
+        self.restore_seconds = time.perf_counter() - start
+        self.metrics.buttons_restored.inc(self.buttons_restored)
+        self.metrics.buttons_pruned.inc(self.buttons_pruned)
+        print(f"Restored {self.buttons_restored} verification buttons, removed {self.buttons_pruned} "
+              f"deleted ones in {self.restore_seconds:.2f}s")
+
+
+class VerifyButton(discord.ui.DynamicItem[discord.ui.Button], template=r"verify_button"):
+    """The "Verify" button of every verification message, handled without a stored view"""
+
+    def __init__(self):
+        super().__init__(
+            discord.ui.Button(
+                label="Verify",
+                emoji="<:verify:1353299720373669939>",
+                style=discord.ButtonStyle.green,
+                custom_id="verify_button"
             )
-            return
-
-        if user_id in self.cog.timeouts:
-            timeout_end = self.cog.timeouts[user_id]
-            current_time = asyncio.get_event_loop().time()
-
-            if current_time < timeout_end:
-                remaining = int(timeout_end - current_time)
-                minutes = remaining // 60
-                seconds = remaining % 60
+        )
 
-                await interaction.response.send_message(
-                    f"A timeout period is currently active. Please attempt verification again in {minutes}m {seconds}s.",
-                    ephemeral=True
-                )
-                return
-            else:
-                del self.cog.timeouts[user_id]
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls()
 
-        captcha_file, solution = await self.cog.create_captcha()
-        self.cog.active_captchas[user_id] = solution
+    async def callback(self, interaction: discord.Interaction):
+        cog = interaction.client.get_cog("CaptchaVerification")
+        await cog.handle_verification_button(interaction)
 
-        captcha_embed = discord.Embed(
-            title="🔒 Verification Required",
-            description="Please complete the captcha verification below",
-            color=discord.Color.blue()
-        )
-        captcha_embed.set_image(url="attachment://captcha.png")
 
-        captcha_view = CaptchaVerification.CaptchaView(
-            self.cog,
-            solution,
-            user_id,
-            guild_id
-        )
+class VerificationView(discord.ui.View):
+    """The view sent with a verification message, holds only the dynamic Verify button"""
 
-        await interaction.response.send_message(
-            embed=captcha_embed,
-            file=captcha_file,
-            view=captcha_view,
-            ephemeral=True
-        )
+    def __init__(self):
+        super().__init__(timeout=None)
+        self.button_id = f"verify_{random.randint(1000, 9999)}"
+        self.add_item(VerifyButton())
 
 
 async def setup(bot):
@@ -0,0 +1,368 @@
+import copy
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+from cogs.captcha_render import IMAGE_FORMATS, WARP_MODES, captcha_filename
+
+CONFIG_PATH = "verify_config.json"
+
+DEFAULT_CONFIG = {
+    "verified_role_id": 1342506397526655046,
+    "captcha_settings": {
+        "length": 6,
+        "width": 280,
+        "height": 90,
+        "font_size": 40,
+        "font_path": "arial.ttf",
+        "noise_density": 20,
+        "noise_lines": 8,
+        "glyph_angle_step": 5,
+        "glyph_cache_size": 512,
+        "render_backend": "process",
+        "render_workers": 0,
+        "max_concurrent_renders": 0,
+        "image_format": "png",
+        "palette_colors": 32,
+        "compress_level": 6,
+        "image_quality": 80,
+        "webp_method": 0,
+        "warp": "none",
+        "warp_strength": 4,
+        "warp_grid": 20,
+        "warp_fields": 16
+    },
+    "verification_settings": {
+        "max_attempts": 5,
+        "timeout_minutes": 10,
+        "db_filename": "captcha_verification.db",
+        "write_flush_interval": 1.0,
+        "write_batch_size": 100,
+        "challenge_ttl_minutes": 15,
+        "max_tracked_users": 100000,
+        "state_sweep_seconds": 30,
+        "persist_lockouts": True,
+        "restore_concurrency": 8,
+        "config_reload_seconds": 5,
+        "defer_slow_responses": True,
+        "ack_margin_seconds": 1.0
+    },
+    "stateless_challenges": {
+        "enabled": False,
+        "secret": ""
+    },
+    "captcha_pool": {
+        "enabled": True,
+        "size": 200,
+        "low_water": 50,
+        "refill_per_second": 20
+    },
+    "raid_mode": {
+        "enabled": True,
+        "window_seconds": 60,
+        "enter_joins_per_minute": 0,
+        "enter_clicks_per_minute": 60,
+        "exit_ratio": 0.5,
+        "cooldown_seconds": 120,
+        "check_seconds": 5,
+        "duplicate_click_seconds": 10,
+        "max_attempts": 2,
+        "timeout_minutes": 30,
+        "write_flush_interval": 5.0,
+        "write_batch_size": 1000,
+        "render_overrides": {
+            "noise_lines": 4,
+            "compress_level": 1
+        }
+    },
+    "retention": {
+        "enabled": True,
+        "interval_minutes": 60,
+        "batch_size": 500,
+        "batch_pause_seconds": 0.05,
+        "event_days": 30,
+        "minute_rollup_days": 2,
+        "hour_rollup_days": 90,
+        "vacuum_pages": 256,
+        "forget_departed_members": False
+    },
+    "reconcile": {
+        "requests_per_second": 5,
+        "workers": 2,
+        "progress_seconds": 10
+    },
+    "metrics": {
+        "enabled": False,
+        "http_host": "127.0.0.1",
+        "http_port": 9108,
+        "file_path": "",
+        "file_interval": 15,
+        "loop_lag_interval": 0.5
+    },
+    "messages": {
+        "welcome": "Welcome to the server. Please complete the captcha verification process to gain access.",
+        "already_verified": "Your account has already been verified on this server.",
+        "verification_success": "Verification completed successfully. You now have full access to the server.",
+        "verification_failed": "The captcha entry was incorrect. Please attempt verification again.",
+        "verification_timeout": "Maximum verification attempts exceeded. Please try again after the timeout period."
+    }
+}
+
+SYSTEM_FONTS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",  # Linux
+    "/System/Library/Fonts/Helvetica.ttc",  # MacOS
+    "C:\\Windows\\Fonts\\Arial.ttf",  # Windows
+    "arial.ttf",  # Fallback
+]
+
+# Settings a guild can override and their types
+GUILD_SETTINGS = {
+    "verified_role_id": int,
+    "max_attempts": int,
+    "timeout_minutes": int,
+    "already_verified_message": str,
+    "success_message": str,
+    "failed_message": str,
+    "timeout_message": str,
+    "warp": str,
+}
+
+# Settings that only accept some values
+GUILD_SETTING_CHOICES = {
+    "warp": WARP_MODES,
+}
+
+
+def _apply_defaults(config: dict, defaults: dict) -> bool:
+    """Fill in keys missing from an existing config, returns True if anything was added"""
+    changed = False
+    for key, value in defaults.items():
+        if key not in config:
+            config[key] = copy.deepcopy(value)
+            changed = True
+        elif isinstance(value, dict) and isinstance(config[key], dict):
+            changed = _apply_defaults(config[key], value) or changed
+    return changed
+
+
+def save_config(config: dict, config_path: str = CONFIG_PATH):
+    # Write to a temporary file first so another bot process never reads half a file,
+    # the name is per process because all of them add missing defaults on startup
+    temp_path = f"{config_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as config_file:
+        json.dump(config, config_file, indent=4)
+    os.replace(temp_path, config_path)
+
+
+def read_config(config_path: str = CONFIG_PATH) -> dict:
+    """Read the config file and add missing default settings, raises if the file can't be read"""
+    with open(config_path, 'r') as config_file:
+        config = json.load(config_file)
+
+    # Older config files don't know about newer settings yet
+    if _apply_defaults(config, DEFAULT_CONFIG):
+        save_config(config, config_path)
+        print(f"Added missing default settings to {config_path}")
+
+    return config
+
+
+def load_config(config_path: str = CONFIG_PATH) -> dict:
+    """Load configuration from JSON file or create a default one if it doesn't exist"""
+    # Check if config file exists
+    if not os.path.exists(config_path):
+        # Create default config file
+        default_config = copy.deepcopy(DEFAULT_CONFIG)
+        save_config(default_config, config_path)
+        print(f"Created default configuration file at {config_path}")
+        return default_config
+
+    # Load existing config
+    try:
+        config = read_config(config_path)
+        print(f"Loaded configuration from {config_path}")
+        return config
+    except Exception as e:
+        print(f"ERROR: could not read {config_path}: {e}", file=sys.stderr)
+        print(f"ERROR: falling back to the DEFAULT configuration, verified_role_id and every other "
+              f"setting in {config_path} are ignored until it is fixed", file=sys.stderr)
+        return copy.deepcopy(DEFAULT_CONFIG)
+
+
+def needs_members_intent(config: dict) -> bool:
+    """Whether a setting relies on member join or leave events, which need the privileged members intent"""
+    raid_settings = config["raid_mode"]
+    retention_settings = config["retention"]
+    return ((raid_settings["enabled"] and raid_settings["enter_joins_per_minute"] > 0)
+            or (retention_settings["enabled"] and retention_settings["forget_departed_members"]))
+
+
+def resolve_font(font_path: str) -> str:
+    """The configured font if it exists, otherwise the first system font that does"""
+    if os.path.exists(font_path):
+        return font_path
+
+    for system_font in SYSTEM_FONTS:
+        if os.path.exists(system_font):
+            return system_font
+    return font_path
+
+
+class GuildConfig:
+    """Effective settings for one guild, the file's defaults with the guild's overrides applied.
+
+    ``captcha`` and ``raid_captcha`` are the render settings with the guild's
+    warp mode, the config's own dicts if the guild doesn't change it.
+    """
+
+    __slots__ = tuple(GUILD_SETTINGS) + ("timeout_seconds", "captcha", "raid_captcha", "custom_captcha")
+
+    def __init__(self, values: Dict[str, Any], config: "VerifyConfig"):
+        for key in GUILD_SETTINGS:
+            setattr(self, key, values[key])
+        self.timeout_seconds = self.timeout_minutes * 60
+
+        self.custom_captcha = self.warp != config.captcha["warp"]
+        if self.custom_captcha:
+            self.captcha = dict(config.captcha, warp=self.warp)
+            self.raid_captcha = dict(config.raid_captcha, warp=self.warp)
+        else:
+            self.captcha = config.captcha
+            self.raid_captcha = config.raid_captcha
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {key: getattr(self, key) for key in GUILD_SETTINGS}
+
+
+class VerifyConfig:
+    """Typed view of verify_config.json with the values the hot paths need precomputed.
+
+    ``data`` is the parsed file. Settings that are only read once at startup
+    are taken from it through ``section``. ``captcha`` is the settings dict
+    handed to the renderer, with the font already resolved to one that exists.
+    """
+
+    __slots__ = ("data", "captcha", "captcha_length", "captcha_filename", "challenge_ttl", "persist_lockouts",
+                 "restore_concurrency", "reload_seconds", "guild_defaults", "raid_captcha", "raid_max_attempts",
+                 "raid_timeout_minutes")
+
+    def __init__(self, data: dict):
+        self.data = data
+
+        captcha_settings = data["captcha_settings"]
+        if captcha_settings["image_format"] not in IMAGE_FORMATS:
+            print(f"Unknown image_format '{captcha_settings['image_format']}', captchas are sent as PNG")
+        if captcha_settings["warp"] not in WARP_MODES:
+            print(f"Unknown warp '{captcha_settings['warp']}', captchas are not warped")
+
+        # Resolved here instead of rewriting the config file with the fallback font
+        self.captcha = dict(captcha_settings, font_path=resolve_font(captcha_settings["font_path"]))
+        self.captcha_length = captcha_settings["length"]
+        self.captcha_filename = captcha_filename(self.captcha)
+
+        verification_settings = data["verification_settings"]
+        self.challenge_ttl = verification_settings["challenge_ttl_minutes"] * 60
+        self.persist_lockouts = verification_settings["persist_lockouts"]
+        self.restore_concurrency = verification_settings["restore_concurrency"]
+        self.reload_seconds = verification_settings["config_reload_seconds"]
+
+        # Cheaper renders while a guild is raided, the format stays the same so the filename does too
+        raid_settings = data["raid_mode"]
+        self.raid_captcha = {**self.captcha, **raid_settings["render_overrides"],
+                             "image_format": self.captcha["image_format"]}
+        self.raid_max_attempts = raid_settings["max_attempts"]
+        self.raid_timeout_minutes = raid_settings["timeout_minutes"]
+
+        messages = data["messages"]
+        self.guild_defaults = {
+            "verified_role_id": data["verified_role_id"],
+            "max_attempts": verification_settings["max_attempts"],
+            "timeout_minutes": verification_settings["timeout_minutes"],
+            "already_verified_message": messages["already_verified"],
+            "success_message": messages["verification_success"],
+            "failed_message": messages["verification_failed"],
+            "timeout_message": messages["verification_timeout"],
+            "warp": captcha_settings["warp"],
+        }
+
+    def section(self, name: str) -> dict:
+        return self.data[name]
+
+
+class GuildConfigCache:
+    """Per-guild overrides on top of a ``VerifyConfig``.
+
+    The merged ``GuildConfig`` for a guild is built on first use and cached
+    until the guild's overrides or the config file change, so a lookup on the
+    hot path is a single dict access.
+    """
+
+    def __init__(self, config: VerifyConfig):
+        self.config = config
+        self.overrides: Dict[int, Dict[str, Any]] = {}
+        self._cache: Dict[int, GuildConfig] = {}
+        self._defaults = GuildConfig(config.guild_defaults, config)
+
+    def load(self, overrides: Dict[int, Dict[str, Any]]):
+        self.overrides = {
+            guild_id: {key: value for key, value in values.items() if key in GUILD_SETTINGS}
+            for guild_id, values in overrides.items()
+        }
+        self._cache.clear()
+
+    def set_config(self, config: VerifyConfig):
+        self.config = config
+        self._defaults = GuildConfig(config.guild_defaults, config)
+        self._cache.clear()
+
+    def get(self, guild_id: int) -> GuildConfig:
+        guild_config = self._cache.get(guild_id)
+        if guild_config is None:
+            overrides = self.overrides.get(guild_id)
+            guild_config = (GuildConfig({**self.config.guild_defaults, **overrides}, self.config)
+                            if overrides else self._defaults)
+            self._cache[guild_id] = guild_config
+        return guild_config
+
+    @staticmethod
+    def parse(key: str, value: str) -> Any:
+        """Convert a value typed in a command to the setting's type, raises ValueError if it doesn't fit"""
+        if key not in GUILD_SETTINGS:
+            raise ValueError(f"Unknown setting `{key}`, available: {', '.join(GUILD_SETTINGS)}")
+
+        if key in GUILD_SETTING_CHOICES:
+            if value not in GUILD_SETTING_CHOICES[key]:
+                raise ValueError(f"`{key}` must be one of: {', '.join(GUILD_SETTING_CHOICES[key])}")
+            return value
+
+        if GUILD_SETTINGS[key] is str:
+            return value
+
+        # Also accept role mentions like <@&123>
+        digits = value.strip("<@&>") if key == "verified_role_id" else value
+        try:
+            number = int(digits)
+        except ValueError:
+            raise ValueError(f"`{key}` must be a whole number")
+
+        if key == "max_attempts" and number < 1:
+            raise ValueError("`max_attempts` must be at least 1")
+        if number < 0:
+            raise ValueError(f"`{key}` can't be negative")
+        return number
+
+    def set_override(self, guild_id: int, key: str, value: Any):
+        self.overrides.setdefault(guild_id, {})[key] = value
+        self._cache.pop(guild_id, None)
+
+    def clear_overrides(self, guild_id: int, key: Optional[str] = None) -> List[str]:
+        """Remove one or all overrides of a guild, returns the removed keys"""
+        overrides = self.overrides.get(guild_id, {})
+        keys = [key] if key is not None else list(overrides)
+        removed = [key for key in keys if overrides.pop(key, None) is not None]
+
+        if not overrides:
+            self.overrides.pop(guild_id, None)
+        self._cache.pop(guild_id, None)
+        return removed
@@ -0,0 +1,686 @@
+import asyncio
+import json
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+
+PRAGMAS = (
+    # First, so the pragmas below wait for another process opening the file at the same time
+    "PRAGMA busy_timeout = 5000",
+    # Only takes effect in a new file and has to come before WAL, existing files are left alone
+    "PRAGMA auto_vacuum = INCREMENTAL",
+    "PRAGMA journal_mode = WAL",
+    # With WAL, NORMAL only syncs on checkpoints and is still crash safe
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 67108864",
+)
+
+# PRAGMA auto_vacuum value that lets freed pages be given back in small steps
+AUTO_VACUUM_INCREMENTAL = 2
+
+# Rows deleted when the bot leaves a guild: table -> key of the rows. All but
+# active_buttons start their primary key with guild_id, active_buttons is small.
+GUILD_TABLES = {
+    "verified_users": "guild_id, user_id",
+    "lockouts": "guild_id, user_id",
+    "guild_settings": "guild_id, key",
+    "active_buttons": "rowid",
+    "verification_rollup_minute": "guild_id, bucket, event",
+    "verification_rollup_hour": "guild_id, bucket, event",
+}
+
+
+# Bumped whenever a migration is added to VerificationDatabase._migrate
+SCHEMA_VERSION = 4
+
+# Event types stored in verification_events and the rollup tables
+EVENT_ISSUED = 1
+EVENT_SOLVED = 2
+EVENT_FAILED = 3
+EVENT_LOCKED_OUT = 4
+
+EVENT_NAMES = {
+    EVENT_ISSUED: "issued",
+    EVENT_SOLVED: "solved",
+    EVENT_FAILED: "failed",
+    EVENT_LOCKED_OUT: "locked_out",
+}
+
+# Rollup table -> seconds per bucket
+ROLLUP_TABLES = {
+    "verification_rollup_minute": 60,
+    "verification_rollup_hour": 3600,
+}
+
+
+class VerificationDatabase:
+    """Long-lived SQLite connection used from a single dedicated thread.
+
+    All queries run on the database thread, so the event loop never waits on
+    disk I/O and the connection (with its prepared statement cache) is reused
+    for every query instead of reconnecting each time.
+
+    Verified users are additionally kept in memory per guild (``verified``),
+    loaded once on ``open`` and updated by ``mark_as_verified`` and
+    ``remove_verified``, so checking whether someone is verified never
+    touches the database.
+
+    Verification, button and timeout writes are queued and written behind in batches:
+    a flush happens every ``flush_interval`` seconds, or as soon as
+    ``batch_size`` writes are pending, and always on ``close``. Repeated
+    writes for the same row are coalesced into one.
+
+    Verification events (``record_event``) are appended to an event log in
+    the same batches, and the per-minute and per-hour rollups are updated in
+    the same transaction, so statistics never have to scan the log.
+    """
+
+    def __init__(self, filename: str, flush_interval: float = 1.0, batch_size: int = 100, shard_count: int = 0,
+                 shard_ids: Optional[Sequence[int]] = None):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.batch_size = max(batch_size, 1)
+        # A process owning only some shards keeps only the rows of their guilds in memory
+        self.shard_count = shard_count or 0
+        self.shard_ids: Optional[Set[int]] = set(shard_ids) if self.shard_count and shard_ids is not None else None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="verify-db")
+        self._conn: Optional[sqlite3.Connection] = None
+        self.auto_vacuum_incremental = False
+        self.verified: Dict[int, Set[int]] = {}
+        # message_id -> (button_id, guild_id) of the stored verification messages
+        self.button_messages: Dict[int, Tuple[str, int]] = {}
+
+        # Pending writes, dicts so repeated writes for the same key coalesce.
+        # Verifications map to False and buttons to None if the row should be deleted.
+        self._pending_verified: Dict[Tuple[int, int], bool] = {}
+        self._pending_buttons: Dict[str, Optional[Tuple[str, int, int, int]]] = {}
+        self._pending_lockouts: Dict[Tuple[int, int], Optional[float]] = {}
+        # (guild_id, user_id, event, unix time), appended and never coalesced
+        self._pending_events: List[Tuple[int, int, int, int]] = []
+        self._flush_wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.events_recorded = 0
+        self.max_batch = 0
+        self.total_flush_time = 0.0
+        self.last_flush_time = 0.0
+        self.max_flush_time = 0.0
+
+        self.queries = 0
+        self.total_query_time = 0.0
+        self.max_query_time = 0.0
+
+        # Optional callback with the duration of every database call
+        self.on_query = None
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.total_query_time += elapsed
+            self.max_query_time = max(self.max_query_time, elapsed)
+            if self.on_query is not None:
+                self.on_query(elapsed)
+
+    async def open(self):
+        await self._run(self._open)
+        self.verified = await self._run(self._load_verified)
+        self.button_messages = {
+            message_id: (button_id, guild_id)
+            for button_id, message_id, _, guild_id in await self._run(self._fetch_buttons)
+            if self.owns_guild(guild_id)
+        }
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+
+        await self.flush()
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+    @property
+    def pending_writes(self) -> int:
+        return (len(self._pending_verified) + len(self._pending_buttons) + len(self._pending_lockouts)
+                + len(self._pending_events))
+
+    def _queue_write(self):
+        if self.pending_writes >= self.batch_size:
+            self._flush_wakeup.set()
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            # Not asyncio.wait_for, it can swallow the cancellation from close()
+            timer = loop.call_later(self.flush_interval, self._flush_wakeup.set)
+            try:
+                await self._flush_wakeup.wait()
+            finally:
+                timer.cancel()
+            self._flush_wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing verification writes: {e}")
+
+    async def flush(self):
+        """Write all pending verification, button and timeout changes in one transaction"""
+        async with self._flush_lock:
+            if not self.pending_writes:
+                return
+
+            verified = self._pending_verified
+            buttons = self._pending_buttons
+            lockouts = self._pending_lockouts
+            events = self._pending_events
+            self._pending_verified = {}
+            self._pending_buttons = {}
+            self._pending_lockouts = {}
+            self._pending_events = []
+
+            verified_rows = [key for key, keep in verified.items() if keep]
+            removed_verified = [key for key, keep in verified.items() if not keep]
+            button_rows = [row for row in buttons.values() if row is not None]
+            removed_buttons = [(button_id,) for button_id, row in buttons.items() if row is None]
+            lockout_rows = [key + (expires_at,) for key, expires_at in lockouts.items() if expires_at is not None]
+            removed_lockouts = [key for key, expires_at in lockouts.items() if expires_at is None]
+            batch = len(verified) + len(buttons) + len(lockouts) + len(events)
+
+            start = time.perf_counter()
+            try:
+                await self._run(self._write_batch, verified_rows, removed_verified, button_rows, removed_buttons,
+                                lockout_rows, removed_lockouts, events)
+            except Exception:
+                # Put the writes back so the next flush retries them, newer writes win
+                for key, keep in verified.items():
+                    self._pending_verified.setdefault(key, keep)
+                for button_id, row in buttons.items():
+                    self._pending_buttons.setdefault(button_id, row)
+                for key, expires_at in lockouts.items():
+                    self._pending_lockouts.setdefault(key, expires_at)
+                self._pending_events[:0] = events
+                raise
+
+            elapsed = time.perf_counter() - start
+            self.flushes += 1
+            self.rows_flushed += batch
+            self.max_batch = max(self.max_batch, batch)
+            self.total_flush_time += elapsed
+            self.last_flush_time = elapsed
+            self.max_flush_time = max(self.max_flush_time, elapsed)
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.filename, cached_statements=256)
+        for pragma in PRAGMAS:
+            self._conn.execute(pragma)
+        self._migrate()
+        self._check_auto_vacuum()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _check_auto_vacuum(self):
+        self.auto_vacuum_incremental = (
+            self._conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+        )
+        if not self.auto_vacuum_incremental:
+            # Converting needs a full VACUUM, which locks the file for the whole rebuild
+            print(f"{self.filename} doesn't give freed space back. Convert it once while the bot is stopped with: "
+                  f"sqlite3 {self.filename} \"PRAGMA auto_vacuum = INCREMENTAL; VACUUM;\"")
+
+    def _create_verified_users(self, name: str):
+        self._conn.execute(f'''
+        CREATE TABLE {name} (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            verified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+        ''')
+
+    def _create_tables(self):
+        """Tables of a new file, verified_users already in its version 1 form"""
+        self._create_verified_users("verified_users")
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS active_buttons (
+            button_id TEXT PRIMARY KEY,
+            message_id INTEGER,
+            channel_id INTEGER,
+            guild_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+
+    def _migrate(self):
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        # IMMEDIATE so two bot processes starting at once don't both migrate
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+
+            # A new file starts at version 1, the steps below add the later tables
+            if version == 0 and not self._conn.execute("SELECT count(*) FROM sqlite_master").fetchone()[0]:
+                self._create_tables()
+                version = 1
+
+            if version < 1:
+                # verified_users was keyed on user_id alone, so verifying in a second
+                # guild replaced the first one. Key it on (guild_id, user_id) instead.
+                self._create_verified_users("verified_users_new")
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO verified_users_new (guild_id, user_id, verified_at) "
+                    "SELECT guild_id, user_id, verified_at FROM verified_users WHERE guild_id IS NOT NULL"
+                )
+                self._conn.execute("DROP TABLE verified_users")
+                self._conn.execute("ALTER TABLE verified_users_new RENAME TO verified_users")
+
+            if version < 2:
+                self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS lockouts (
+                    guild_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (guild_id, user_id)
+                ) WITHOUT ROWID
+                ''')
+
+            if version < 3:
+                # Per guild overrides of verify_config.json, values are JSON encoded
+                self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS guild_settings (
+                    guild_id INTEGER NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (guild_id, key)
+                ) WITHOUT ROWID
+                ''')
+
+            if version < 4:
+                # Append-only log, rowids grow with time so it needs no index of its own
+                self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS verification_events (
+                    id INTEGER PRIMARY KEY,
+                    guild_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    event INTEGER NOT NULL,
+                    at INTEGER NOT NULL
+                )
+                ''')
+                # Counts per guild, bucket (unix time // bucket seconds) and event type
+                for table in ROLLUP_TABLES:
+                    self._conn.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        guild_id INTEGER NOT NULL,
+                        bucket INTEGER NOT NULL,
+                        event INTEGER NOT NULL,
+                        count INTEGER NOT NULL,
+                        PRIMARY KEY (guild_id, bucket, event)
+                    ) WITHOUT ROWID
+                    ''')
+
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+
+    def _load_verified(self) -> Dict[int, Set[int]]:
+        query = "SELECT guild_id, user_id FROM verified_users"
+        params: Tuple[int, ...] = ()
+        if self.shard_ids is not None:
+            # Discord's shard formula, so rows of other processes' guilds are never loaded
+            query += f" WHERE (guild_id >> 22) % ? IN ({', '.join('?' * len(self.shard_ids))})"
+            params = (self.shard_count, *self.shard_ids)
+
+        verified: Dict[int, Set[int]] = {}
+        for guild_id, user_id in self._conn.execute(query, params):
+            verified.setdefault(guild_id, set()).add(user_id)
+        return verified
+
+    def _write_batch(self, verified_rows, removed_verified, button_rows, removed_buttons, lockout_rows,
+                     removed_lockouts, event_rows=()):
+        try:
+            if removed_verified:
+                self._conn.executemany("DELETE FROM verified_users WHERE guild_id = ? AND user_id = ?", removed_verified)
+            if verified_rows:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO verified_users (guild_id, user_id) VALUES (?, ?)",
+                    verified_rows
+                )
+            if removed_buttons:
+                self._conn.executemany("DELETE FROM active_buttons WHERE button_id = ?", removed_buttons)
+            if button_rows:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO active_buttons (button_id, message_id, channel_id, guild_id) VALUES (?, ?, ?, ?)",
+                    button_rows
+                )
+            if removed_lockouts:
+                self._conn.executemany("DELETE FROM lockouts WHERE guild_id = ? AND user_id = ?", removed_lockouts)
+            if lockout_rows:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO lockouts (guild_id, user_id, expires_at) VALUES (?, ?, ?)",
+                    lockout_rows
+                )
+            if event_rows:
+                self._write_events(event_rows)
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+
+    def _write_events(self, event_rows):
+        self._conn.executemany(
+            "INSERT INTO verification_events (guild_id, user_id, event, at) VALUES (?, ?, ?, ?)",
+            event_rows
+        )
+        for table, seconds in ROLLUP_TABLES.items():
+            counts = Counter((guild_id, at // seconds, event) for guild_id, _, event, at in event_rows)
+            self._conn.executemany(
+                f"INSERT INTO {table} (guild_id, bucket, event, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (guild_id, bucket, event) DO UPDATE SET count = count + excluded.count",
+                [key + (count,) for key, count in counts.items()]
+            )
+
+    def _event_counts(self, guild_id: int, table: str, since_bucket: int) -> List[Tuple[int, int, int]]:
+        return self._conn.execute(
+            f"SELECT bucket, event, count FROM {table} WHERE guild_id = ? AND bucket >= ? ORDER BY bucket",
+            (guild_id, since_bucket)
+        ).fetchall()
+
+    def _purge_guild(self, guild_id: int, limit: int) -> int:
+        """Delete up to ``limit`` rows of the guild, its events are left to ``_prune_events``"""
+        deleted = 0
+        try:
+            for table, key in GUILD_TABLES.items():
+                if deleted >= limit:
+                    break
+                deleted += self._conn.execute(
+                    f"DELETE FROM {table} WHERE ({key}) IN (SELECT {key} FROM {table} WHERE guild_id = ? LIMIT ?)",
+                    (guild_id, limit - deleted)
+                ).rowcount
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+        return deleted
+
+    def _first_event_since(self, since: int) -> int:
+        """Id of the first event at or after ``since``, ids and times grow together"""
+        row = self._conn.execute(
+            "SELECT id FROM verification_events WHERE at >= ? ORDER BY id LIMIT 1", (since,)
+        ).fetchone()
+        if row is None:
+            row = self._conn.execute("SELECT coalesce(max(id), 0) + 1 FROM verification_events").fetchone()
+        return row[0]
+
+    def _prune_events(self, before_id: int, limit: int) -> int:
+        deleted = self._conn.execute(
+            "DELETE FROM verification_events WHERE id IN "
+            "(SELECT id FROM verification_events WHERE id < ? ORDER BY id LIMIT ?)",
+            (before_id, limit)
+        ).rowcount
+        self._conn.commit()
+        return deleted
+
+    def _prune_rollup(self, table: str, before_bucket: int, after_guild: int, limit: int) -> Tuple[int, Optional[int]]:
+        """Delete up to ``limit`` buckets older than ``before_bucket``, guild by guild.
+
+        Returns the number deleted and the last guild that was finished, the
+        next call continues after it. ``None`` means every guild is done.
+        """
+        deleted = 0
+        try:
+            while deleted < limit:
+                # Jumps from guild to guild through the primary key instead of scanning all buckets
+                row = self._conn.execute(
+                    f"SELECT guild_id FROM {table} WHERE guild_id > ? ORDER BY guild_id LIMIT 1", (after_guild,)
+                ).fetchone()
+                if row is None:
+                    after_guild = None
+                    break
+
+                wanted = limit - deleted
+                count = self._conn.execute(
+                    f"DELETE FROM {table} WHERE (guild_id, bucket, event) IN "
+                    f"(SELECT guild_id, bucket, event FROM {table} WHERE guild_id = ? AND bucket < ? LIMIT ?)",
+                    (row[0], before_bucket, wanted)
+                ).rowcount
+                deleted += count
+                if count < wanted:
+                    after_guild = row[0]
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+        return deleted, after_guild
+
+    def _incremental_vacuum(self, pages: int) -> Tuple[int, int]:
+        """Give up to ``pages`` free pages back to the file system, returns (freed, still free)"""
+        before = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if before:
+            # executescript steps the pragma to the end, execute would free only one page
+            self._conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        after = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return before - after, after
+
+    def _checkpoint(self) -> Tuple[int, int, int]:
+        # PASSIVE copies what it can without waiting for readers or blocking writers
+        return tuple(self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone())
+
+    def _file_stats(self) -> Tuple[int, int, int]:
+        return (self._conn.execute("PRAGMA page_count").fetchone()[0],
+                self._conn.execute("PRAGMA freelist_count").fetchone()[0],
+                self._conn.execute("PRAGMA page_size").fetchone()[0])
+
+    def _load_lockouts(self, now: float) -> List[Tuple[int, int, float]]:
+        self._conn.execute("DELETE FROM lockouts WHERE expires_at <= ?", (now,))
+        self._conn.commit()
+        return self._conn.execute("SELECT guild_id, user_id, expires_at FROM lockouts").fetchall()
+
+    def _load_guild_settings(self) -> Dict[int, Dict[str, Any]]:
+        settings: Dict[int, Dict[str, Any]] = {}
+        for guild_id, key, value in self._conn.execute("SELECT guild_id, key, value FROM guild_settings"):
+            settings.setdefault(guild_id, {})[key] = json.loads(value)
+        return settings
+
+    def _set_guild_setting(self, guild_id: int, key: str, value: str):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO guild_settings (guild_id, key, value) VALUES (?, ?, ?)",
+            (guild_id, key, value)
+        )
+        self._conn.commit()
+
+    def _delete_guild_settings(self, guild_id: int, keys: List[str]):
+        self._conn.executemany("DELETE FROM guild_settings WHERE guild_id = ? AND key = ?",
+                               [(guild_id, key) for key in keys])
+        self._conn.commit()
+
+    def _fetch_buttons(self) -> List[Tuple[str, int, int, int]]:
+        cursor = self._conn.execute("SELECT button_id, message_id, channel_id, guild_id FROM active_buttons")
+        return cursor.fetchall()
+
+    def owns_guild(self, guild_id: int) -> bool:
+        """Whether the guild is on one of this process' shards"""
+        return self.shard_ids is None or (guild_id >> 22) % self.shard_count in self.shard_ids
+
+    def is_verified(self, user_id: int, guild_id: int) -> bool:
+        verified = self.verified.get(guild_id)
+        return verified is not None and user_id in verified
+
+    def mark_as_verified(self, user_id: int, guild_id: int):
+        self.verified.setdefault(guild_id, set()).add(user_id)
+        self._pending_verified[(guild_id, user_id)] = True
+        self._queue_write()
+
+    def remove_verified(self, guild_id: int, user_ids: List[int]):
+        verified = self.verified.get(guild_id)
+        for user_id in user_ids:
+            if verified is not None:
+                verified.discard(user_id)
+            self._pending_verified[(guild_id, user_id)] = False
+        self._queue_write()
+
+    def store_button(self, button_id: str, message_id: int, channel_id: int, guild_id: int):
+        self.button_messages[message_id] = (button_id, guild_id)
+        self._pending_buttons[button_id] = (button_id, message_id, channel_id, guild_id)
+        self._queue_write()
+
+    def remove_button(self, button_id: str):
+        self.remove_buttons([button_id])
+
+    def remove_buttons(self, button_ids: List[str]):
+        removed = set(button_ids)
+        self.button_messages = {
+            message_id: entry for message_id, entry in self.button_messages.items() if entry[0] not in removed
+        }
+        for button_id in button_ids:
+            self._pending_buttons[button_id] = None
+        self._queue_write()
+
+    def remove_buttons_for_messages(self, message_ids) -> int:
+        """Forget the verification buttons on deleted messages, returns how many there were"""
+        removed = 0
+        for message_id in message_ids:
+            entry = self.button_messages.pop(message_id, None)
+            if entry is not None:
+                self._pending_buttons[entry[0]] = None
+                removed += 1
+        if removed:
+            self._queue_write()
+        return removed
+
+    def forget_guild(self, guild_id: int):
+        """Drop the guild from memory and the pending writes, ``purge_guild`` deletes its rows"""
+        self.verified.pop(guild_id, None)
+        self.button_messages = {
+            message_id: entry for message_id, entry in self.button_messages.items() if entry[1] != guild_id
+        }
+        self._pending_verified = {key: keep for key, keep in self._pending_verified.items() if key[0] != guild_id}
+        self._pending_lockouts = {
+            key: expires_at for key, expires_at in self._pending_lockouts.items() if key[0] != guild_id
+        }
+        self._pending_buttons = {
+            button_id: row for button_id, row in self._pending_buttons.items() if row is None or row[3] != guild_id
+        }
+
+    def record_event(self, guild_id: int, user_id: int, event: int):
+        """Append a verification event, one of the ``EVENT_*`` constants"""
+        self._pending_events.append((guild_id, user_id, event, int(time.time())))
+        self.events_recorded += 1
+        self._queue_write()
+
+    def store_lockout(self, guild_id: int, user_id: int, expires_at: float):
+        self._pending_lockouts[(guild_id, user_id)] = expires_at
+        self._queue_write()
+
+    def remove_lockouts(self, keys: List[Tuple[int, int]]):
+        for key in keys:
+            self._pending_lockouts[key] = None
+        self._queue_write()
+
+    async def load_lockouts(self) -> List[Tuple[int, int, float]]:
+        """Timeouts that haven't ended yet, expired ones are deleted"""
+        await self.flush()
+        return await self._run(self._load_lockouts, time.time())
+
+    async def event_counts(self, guild_id: int, seconds: int) -> Dict[int, Dict[int, int]]:
+        """Event counts of the last ``seconds`` per bucket start time and event type, read from the rollups.
+
+        Periods of up to three hours are read per minute, longer ones per hour,
+        so the number of rows read depends only on the period.
+        """
+        await self.flush()
+        table, bucket_seconds = (("verification_rollup_minute", 60) if seconds <= 3 * 3600
+                                 else ("verification_rollup_hour", 3600))
+        since_bucket = (int(time.time()) - seconds) // bucket_seconds + 1
+        rows = await self._run(self._event_counts, guild_id, table, since_bucket)
+
+        counts: Dict[int, Dict[int, int]] = {}
+        for bucket, event, count in rows:
+            counts.setdefault(bucket * bucket_seconds, {})[event] = count
+        return counts
+
+    async def purge_guild(self, guild_id: int, limit: int) -> int:
+        """Delete up to ``limit`` stored rows of a guild the bot left, returns how many were deleted"""
+        return await self._run(self._purge_guild, guild_id, limit)
+
+    async def first_event_since(self, since: int) -> int:
+        return await self._run(self._first_event_since, since)
+
+    async def prune_events(self, before_id: int, limit: int) -> int:
+        """Delete up to ``limit`` of the oldest events with an id below ``before_id``"""
+        return await self._run(self._prune_events, before_id, limit)
+
+    async def prune_rollup(self, table: str, before_bucket: int, after_guild: int,
+                           limit: int) -> Tuple[int, Optional[int]]:
+        return await self._run(self._prune_rollup, table, before_bucket, after_guild, limit)
+
+    async def incremental_vacuum(self, pages: int) -> Tuple[int, int]:
+        return await self._run(self._incremental_vacuum, pages)
+
+    async def checkpoint(self) -> Tuple[int, int, int]:
+        """Checkpoint the WAL without blocking, returns (busy, WAL pages, pages checkpointed)"""
+        return await self._run(self._checkpoint)
+
+    async def file_stats(self) -> Tuple[int, int, int]:
+        """Page count, free pages and page size of the database file"""
+        return await self._run(self._file_stats)
+
+    async def load_guild_settings(self) -> Dict[int, Dict[str, Any]]:
+        return await self._run(self._load_guild_settings)
+
+    async def set_guild_setting(self, guild_id: int, key: str, value: Any):
+        # Settings change rarely, they are written right away instead of batched
+        await self._run(self._set_guild_setting, guild_id, key, json.dumps(value))
+
+    async def delete_guild_settings(self, guild_id: int, keys: List[str]):
+        await self._run(self._delete_guild_settings, guild_id, keys)
+
+    async def fetch_buttons(self) -> List[Tuple[str, int, int, int]]:
+        await self.flush()
+        return await self._run(self._fetch_buttons)
+
+    def stats(self) -> Dict[str, float]:
+        average = self.total_query_time / self.queries if self.queries else 0.0
+
+        return {
+            "verified_users": sum(len(users) for users in self.verified.values()),
+            "queries": self.queries,
+            "avg_query_ms": round(average * 1000, 3),
+            "max_query_ms": round(self.max_query_time * 1000, 3),
+            "pending_writes": self.pending_writes,
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "events_recorded": self.events_recorded,
+            "avg_batch": round(self.rows_flushed / self.flushes, 1) if self.flushes else 0.0,
+            "max_batch": self.max_batch,
+            "last_flush_ms": round(self.last_flush_time * 1000, 3),
+            "avg_flush_ms": round(self.total_flush_time / self.flushes * 1000, 3) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_time * 1000, 3),
+        }
@@ -0,0 +1,271 @@
+import asyncio
+import bisect
+import functools
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import discord
+
+from cogs.verify_pipeline import is_missed_ack
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (5_000, 10_000, 20_000, 30_000, 40_000, 60_000, 80_000, 120_000, 200_000)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: LabelKey, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    __slots__ = ("name", "help", "_values")
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(sorted(labels.items())) if labels else ()
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    __slots__ = ("name", "help", "buckets", "_series")
+
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # Per label set: count per bucket (last one is +Inf), sum, count
+        self._series: Dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items())) if labels else ()
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                bucket_labels = _format_labels(labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class _NullMetric:
+    """Stands in for every metric while metrics are disabled"""
+
+    __slots__ = ()
+
+    def inc(self, amount: float = 1, **labels: str):
+        pass
+
+    def observe(self, value: float, **labels: str):
+        pass
+
+
+NULL_METRIC = _NullMetric()
+
+
+class CaptchaMetrics:
+    """Counters and histograms for the verification flow in Prometheus text format.
+
+    When disabled every metric is a shared no-op object and no background task
+    is started, so the instrumented code paths only pay for one method call.
+    When enabled the metrics are served at ``/metrics`` on ``http_host``:``http_port``
+    and/or written to ``file_path`` every ``file_interval`` seconds, and the
+    event loop lag is sampled every ``loop_lag_interval`` seconds.
+    """
+
+    def __init__(self, enabled: bool = False, http_host: str = "127.0.0.1", http_port: int = 0,
+                 file_path: str = "", file_interval: float = 15, loop_lag_interval: float = 0.5):
+        self.enabled = enabled
+        self.http_host = http_host
+        self.http_port = http_port
+        self.file_path = file_path
+        self.file_interval = file_interval
+        self.loop_lag_interval = loop_lag_interval
+
+        self._metrics: list = []
+        self._tasks: List[asyncio.Task] = []
+        self._runner = None
+
+        self.render_seconds = self._histogram(
+            "captcha_render_seconds", "Time to render one captcha image")
+        self.image_bytes = self._histogram(
+            "captcha_image_bytes", "Size of the encoded captcha image", SIZE_BUCKETS)
+        self.db_query_seconds = self._histogram(
+            "captcha_db_query_seconds", "Time of one database call including the wait for the database thread")
+        self.interaction_seconds = self._histogram(
+            "captcha_interaction_seconds", "Time from receiving an interaction until the callback answered it")
+        self.interaction_stage_seconds = self._histogram(
+            "captcha_interaction_stage_seconds", "Time spent in each stage of answering an interaction")
+        self.loop_lag_seconds = self._histogram(
+            "captcha_event_loop_lag_seconds", "How late the event loop woke up a sleeping task")
+
+        self.verifications = self._counter("captcha_verifications_total", "Successful verifications")
+        self.failures = self._counter("captcha_failures_total", "Wrong captcha answers")
+        self.lockouts = self._counter("captcha_lockouts_total", "Users put in timeout after too many failures")
+        self.buttons_restored = self._counter(
+            "captcha_buttons_restored_total", "Verification messages found again on startup")
+        self.buttons_pruned = self._counter(
+            "captcha_buttons_pruned_total", "Stored verification messages that no longer exist")
+        self.interaction_errors = self._counter(
+            "captcha_interaction_errors_total", "Interaction callbacks that raised an exception")
+        self.deferred_responses = self._counter(
+            "captcha_deferred_responses_total", "Interactions deferred because the answer wasn't ready in time")
+        self.missed_acks = self._counter(
+            "captcha_missed_acks_total", "Interactions answered after Discord's deadline (Unknown interaction)")
+        self.raid_mode_changes = self._counter(
+            "captcha_raid_mode_changes_total", "Guilds entering or leaving raid mode")
+        self.shed_clicks = self._counter(
+            "captcha_shed_clicks_total", "Repeated Verify clicks answered without a new captcha during a raid")
+
+    def _histogram(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        if not self.enabled:
+            return NULL_METRIC
+        metric = Histogram(name, help, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def _counter(self, name: str, help: str):
+        if not self.enabled:
+            return NULL_METRIC
+        metric = Counter(name, help)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    async def start(self):
+        if not self.enabled:
+            return
+
+        self._tasks.append(asyncio.create_task(self._sample_loop_lag()))
+        if self.file_path:
+            self._tasks.append(asyncio.create_task(self._write_file_loop()))
+        if self.http_port:
+            try:
+                await self._start_http()
+            except OSError as e:
+                print(f"Error starting metrics endpoint on port {self.http_port}: {e}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks.clear()
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+        if self.enabled and self.file_path:
+            self.write_file()
+
+    async def _start_http(self):
+        # aiohttp is installed with discord.py
+        from aiohttp import web
+
+        async def handle_metrics(request):
+            return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.http_host, self.http_port).start()
+        print(f"Serving metrics on http://{self.http_host}:{self.http_port}/metrics")
+
+    def write_file(self):
+        # Write to a temporary file first so a scraper never reads half a file
+        temp_path = f"{self.file_path}.tmp"
+        with open(temp_path, "w") as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(temp_path, self.file_path)
+
+    async def _write_file_loop(self):
+        while True:
+            await asyncio.sleep(self.file_interval)
+            try:
+                self.write_file()
+            except OSError as e:
+                print(f"Error writing metrics file: {e}")
+
+    async def _sample_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.loop_lag_interval)
+            self.loop_lag_seconds.observe(max(loop.time() - start - self.loop_lag_interval, 0.0))
+
+
+def instrument_interaction(callback_name: str):
+    """Time an interaction callback and count its errors in the verification cog's metrics.
+
+    An answer that came too late is counted as a missed ack, whether or not
+    metrics are enabled, instead of being raised.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, interaction, *args):
+            cog = interaction.client.get_cog("CaptchaVerification")
+            metrics: Optional[CaptchaMetrics] = getattr(cog, "metrics", None)
+            enabled = metrics is not None and metrics.enabled
+
+            start = time.perf_counter()
+            try:
+                return await func(self, interaction, *args)
+            except discord.NotFound as e:
+                if not is_missed_ack(e) or cog is None:
+                    raise
+                cog.pipeline.record_missed_ack(callback_name)
+                if enabled:
+                    metrics.missed_acks.inc(callback=callback_name)
+            except Exception:
+                if enabled:
+                    metrics.interaction_errors.inc(callback=callback_name)
+                raise
+            finally:
+                if enabled:
+                    metrics.interaction_seconds.observe(time.perf_counter() - start, callback=callback_name)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,137 @@
+import asyncio
+import time
+from typing import Awaitable, Dict, List, Tuple
+
+import discord
+
+# Discord fails an interaction that isn't acknowledged within 3 seconds
+INTERACTION_DEADLINE = 3.0
+
+# Error code of the 404 returned when answering an interaction too late
+UNKNOWN_INTERACTION = 10062
+
+
+def is_missed_ack(error: Exception) -> bool:
+    return isinstance(error, discord.NotFound) and error.code == UNKNOWN_INTERACTION
+
+
+class StageTrace:
+    """Times the stages of one interaction, each ``mark`` records the time since the previous one"""
+
+    __slots__ = ("pipeline", "callback", "_last")
+
+    def __init__(self, pipeline, callback: str):
+        self.pipeline = pipeline
+        self.callback = callback
+        self._last = time.perf_counter()
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.pipeline.record_stage(self.callback, stage, now - self._last)
+        self._last = now
+
+
+class ResponsePipeline:
+    """Answers interactions directly when possible and defers them when the work would miss the deadline.
+
+    ``run`` starts the slow part of a response (rendering, a role change) and
+    waits for it only as long as the interaction has time left, minus
+    ``ack_margin`` for sending the answer itself. If it isn't done by then, the
+    interaction is deferred first and ``send``/``edit`` deliver the answer
+    through a followup or by editing the original response instead.
+
+    With ``defer_slow`` off, ``run`` just waits for the work, which is how
+    responses were sent before and shows the missed acks it causes.
+    """
+
+    def __init__(self, defer_slow: bool = True, ack_margin: float = 1.0, on_stage=None, on_defer=None):
+        self.defer_slow = defer_slow
+        self.ack_margin = ack_margin
+        # Optional callbacks for metrics: on_stage(seconds, callback, stage) and on_defer(callback)
+        self.on_stage = on_stage
+        self.on_defer = on_defer
+
+        self.fast_responses = 0
+        self.deferred = 0
+        self.missed_acks: Dict[str, int] = {}
+        # (callback, stage) -> [count, total seconds, max seconds]
+        self._stages: Dict[Tuple[str, str], List[float]] = {}
+
+    @staticmethod
+    def time_left(interaction: discord.Interaction) -> float:
+        """Seconds until the interaction has to be acknowledged, measured from its snowflake timestamp"""
+        age = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+        # A clock that runs behind Discord's would give a negative age
+        return INTERACTION_DEADLINE - max(age, 0.0)
+
+    def trace(self, callback: str) -> StageTrace:
+        return StageTrace(self, callback)
+
+    def record_stage(self, callback: str, stage: str, seconds: float):
+        entry = self._stages.get((callback, stage))
+        if entry is None:
+            entry = self._stages[(callback, stage)] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        if self.on_stage is not None:
+            self.on_stage(seconds, callback=callback, stage=stage)
+
+    def record_missed_ack(self, callback: str):
+        self.missed_acks[callback] = self.missed_acks.get(callback, 0) + 1
+
+    async def run(self, interaction: discord.Interaction, trace: StageTrace, work: Awaitable, stage: str,
+                  thinking: bool = True):
+        """Await ``work``, deferring the interaction first if it can't finish in time.
+
+        ``thinking`` shows the "is thinking..." message while deferred, use it
+        when the answer is a new message. Without it the deferral is silent and
+        the answer should edit the message the component is on.
+        """
+        task = asyncio.ensure_future(work)
+        if self.defer_slow and not interaction.response.is_done():
+            budget = self.time_left(interaction) - self.ack_margin
+            if budget > 0:
+                await asyncio.wait({task}, timeout=budget)
+
+            if not task.done():
+                try:
+                    await interaction.response.defer(ephemeral=True, thinking=thinking)
+                except Exception:
+                    task.cancel()
+                    raise
+                trace.mark("defer")
+                self.deferred += 1
+                if self.on_defer is not None:
+                    self.on_defer(callback=trace.callback)
+
+        try:
+            return await task
+        finally:
+            trace.mark(stage)
+
+    async def send(self, interaction: discord.Interaction, **kwargs):
+        """Send the answer as a new ephemeral message"""
+        if interaction.response.is_done():
+            await interaction.followup.send(ephemeral=True, **kwargs)
+        else:
+            await interaction.response.send_message(ephemeral=True, **kwargs)
+            self.fast_responses += 1
+
+    async def edit(self, interaction: discord.Interaction, **kwargs):
+        """Answer by editing the message the component or modal was used on"""
+        if interaction.response.is_done():
+            await interaction.edit_original_response(**kwargs)
+        else:
+            await interaction.response.edit_message(**kwargs)
+            self.fast_responses += 1
+
+    def stats(self) -> Dict[str, float]:
+        stats = {
+            "fast_responses": self.fast_responses,
+            "deferred": self.deferred,
+            "missed_acks": sum(self.missed_acks.values()),
+        }
+        for (callback, stage), (count, total, longest) in sorted(self._stages.items()):
+            stats[f"{callback}.{stage}"] = f"avg {total / count * 1000:.1f} ms, max {longest * 1000:.1f} ms"
+        return stats
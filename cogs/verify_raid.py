@@ -0,0 +1,226 @@
+import asyncio
+import time
+from typing import Dict, Optional, Set, Tuple
+
+
+class SlidingWindowCounter:
+    """Events of the last ``window`` seconds, counted in one bucket per second.
+
+    Adding and reading are O(1) amortized: buckets that fell out of the window
+    are cleared lazily when the counter is next touched.
+    """
+
+    __slots__ = ("window", "total", "_buckets", "_second")
+
+    def __init__(self, window: int, now: float):
+        self.window = max(int(window), 1)
+        self.total = 0
+        self._buckets = [0] * self.window
+        self._second = int(now)
+
+    def _advance(self, now: float):
+        second = int(now)
+        elapsed = second - self._second
+        if elapsed <= 0:
+            return
+
+        if elapsed >= self.window:
+            self._buckets = [0] * self.window
+            self.total = 0
+        else:
+            for passed in range(self._second + 1, second + 1):
+                index = passed % self.window
+                self.total -= self._buckets[index]
+                self._buckets[index] = 0
+        self._second = second
+
+    def add(self, now: float, amount: int = 1):
+        self._advance(now)
+        self._buckets[self._second % self.window] += amount
+        self.total += amount
+
+    def count(self, now: float) -> int:
+        self._advance(now)
+        return self.total
+
+    def per_minute(self, now: float) -> float:
+        return self.count(now) * 60 / self.window
+
+
+class GuildTraffic:
+    """Join and Verify click rates of one guild and whether it is in raid mode"""
+
+    __slots__ = ("joins", "clicks", "active", "entered_at", "calm_since", "recent_clicks")
+
+    def __init__(self, window: int, now: float):
+        self.joins = SlidingWindowCounter(window, now)
+        self.clicks = SlidingWindowCounter(window, now)
+        self.active = False
+        self.entered_at = 0.0
+        self.calm_since: Optional[float] = None
+        # Last Verify click per user, only tracked while in raid mode
+        self.recent_clicks: Dict[int, float] = {}
+
+
+class RaidDetector:
+    """Switches guilds into raid mode when members join or click Verify too fast.
+
+    A guild enters raid mode as soon as its joins or Verify clicks over the
+    last ``window_seconds`` exceed ``enter_joins_per_minute`` or
+    ``enter_clicks_per_minute`` (``0`` disables that signal). It leaves raid
+    mode once both rates stayed below ``exit_ratio`` of their thresholds for
+    ``cooldown_seconds``, so a raid that pauses briefly doesn't flip the mode
+    back and forth. Leaving is checked every ``check_seconds`` by a background
+    task, which also forgets guilds that went quiet.
+
+    ``on_change(guild_id, active, rates)`` is called on every switch.
+    """
+
+    def __init__(self, on_change, window_seconds: int = 60, enter_joins_per_minute: float = 30,
+                 enter_clicks_per_minute: float = 60, exit_ratio: float = 0.5, cooldown_seconds: float = 120,
+                 duplicate_click_seconds: float = 10, check_seconds: float = 5):
+        self.on_change = on_change
+        self.window = max(int(window_seconds), 1)
+        self.enter_joins = enter_joins_per_minute
+        self.enter_clicks = enter_clicks_per_minute
+        self.exit_ratio = min(max(exit_ratio, 0.0), 1.0)
+        self.cooldown = cooldown_seconds
+        self.duplicate_window = duplicate_click_seconds
+        self.check_seconds = check_seconds
+
+        self._guilds: Dict[int, GuildTraffic] = {}
+        self.active_guilds: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        self.raids_started = 0
+        self.raids_ended = 0
+        self.shed_clicks = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._check_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def is_active(self, guild_id: int) -> bool:
+        return guild_id in self.active_guilds
+
+    def _traffic(self, guild_id: int, now: float) -> GuildTraffic:
+        traffic = self._guilds.get(guild_id)
+        if traffic is None:
+            traffic = self._guilds[guild_id] = GuildTraffic(self.window, now)
+        return traffic
+
+    def _rates(self, traffic: GuildTraffic, now: float) -> Dict[str, float]:
+        return {
+            "joins_per_minute": round(traffic.joins.per_minute(now), 1),
+            "clicks_per_minute": round(traffic.clicks.per_minute(now), 1),
+        }
+
+    def _over(self, rate: float, threshold: float) -> bool:
+        return threshold > 0 and rate >= threshold
+
+    def _maybe_enter(self, guild_id: int, traffic: GuildTraffic, now: float):
+        if traffic.active:
+            return
+
+        if (self._over(traffic.joins.per_minute(now), self.enter_joins)
+                or self._over(traffic.clicks.per_minute(now), self.enter_clicks)):
+            traffic.active = True
+            traffic.entered_at = now
+            traffic.calm_since = None
+            self.active_guilds.add(guild_id)
+            self.raids_started += 1
+            self._notify(guild_id, True, self._rates(traffic, now))
+
+    def _notify(self, guild_id: int, active: bool, rates: Dict[str, float]):
+        try:
+            self.on_change(guild_id, active, rates)
+        except Exception as e:
+            print(f"Error handling raid mode change: {e}")
+
+    def record_join(self, guild_id: int):
+        now = time.monotonic()
+        traffic = self._traffic(guild_id, now)
+        traffic.joins.add(now)
+        self._maybe_enter(guild_id, traffic, now)
+
+    def record_click(self, guild_id: int, user_id: int) -> bool:
+        """Count a Verify click, returns True if it should be shed as a duplicate.
+
+        A click is a duplicate while the guild is in raid mode and the same user
+        clicked less than ``duplicate_click_seconds`` ago.
+        """
+        now = time.monotonic()
+        traffic = self._traffic(guild_id, now)
+        traffic.clicks.add(now)
+        self._maybe_enter(guild_id, traffic, now)
+
+        if not traffic.active:
+            return False
+
+        last_click = traffic.recent_clicks.get(user_id)
+        if last_click is not None and now - last_click < self.duplicate_window:
+            self.shed_clicks += 1
+            return True
+        traffic.recent_clicks[user_id] = now
+        return False
+
+    def check(self):
+        """End raids that calmed down long enough and forget idle guilds"""
+        now = time.monotonic()
+
+        for guild_id, traffic in list(self._guilds.items()):
+            joins = traffic.joins.per_minute(now)
+            clicks = traffic.clicks.per_minute(now)
+
+            if not traffic.active:
+                if not joins and not clicks:
+                    del self._guilds[guild_id]
+                continue
+
+            if (self._over(joins, self.enter_joins * self.exit_ratio)
+                    or self._over(clicks, self.enter_clicks * self.exit_ratio)):
+                traffic.calm_since = None
+            elif traffic.calm_since is None:
+                traffic.calm_since = now
+            elif now - traffic.calm_since >= self.cooldown:
+                traffic.active = False
+                traffic.recent_clicks.clear()
+                self.active_guilds.discard(guild_id)
+                self.raids_ended += 1
+                self._notify(guild_id, False, dict(self._rates(traffic, now),
+                                                   raid_seconds=round(now - traffic.entered_at, 1)))
+                continue
+
+            cutoff = now - self.duplicate_window
+            traffic.recent_clicks = {
+                user_id: clicked_at for user_id, clicked_at in traffic.recent_clicks.items() if clicked_at > cutoff
+            }
+
+    async def _check_loop(self):
+        while True:
+            await asyncio.sleep(self.check_seconds)
+            self.check()
+
+    def rates(self, guild_id: int) -> Tuple[bool, Dict[str, float]]:
+        traffic = self._guilds.get(guild_id)
+        if traffic is None:
+            return False, {"joins_per_minute": 0.0, "clicks_per_minute": 0.0}
+        return traffic.active, self._rates(traffic, time.monotonic())
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "tracked_guilds": len(self._guilds),
+            "raiding_guilds": len(self.active_guilds),
+            "raids_started": self.raids_started,
+            "raids_ended": self.raids_ended,
+            "shed_clicks": self.shed_clicks,
+        }
@@ -0,0 +1,165 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+import discord
+
+RECONCILE_SOURCES = ("db", "roles")
+
+# Largest page the list guild members endpoint returns
+MEMBER_PAGE_SIZE = 1000
+
+
+class RateLimiter:
+    """Spaces calls at least ``1 / rate`` seconds apart across all callers"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / max(rate, 0.01)
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            delay = self._next - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next = max(loop.time(), self._next) + self.interval
+
+
+class RoleReconciler:
+    """Brings the verified role and the verified_users table of one guild back in line.
+
+    With ``source="db"`` the database is trusted: verified members without the
+    role get it, members holding the role without a verification lose it.
+    With ``source="roles"`` the role is trusted and the database is updated
+    to match. Without ``apply`` nothing is changed, only counted.
+
+    Members are fetched from the API page by page and compared against the
+    in-memory index of the database, so memory use doesn't grow with the
+    member count. Role changes go through a bounded queue that ``workers``
+    tasks drain at no more than ``requests_per_second``; when the queue is
+    full, fetching pauses until it has room again.
+    """
+
+    def __init__(self, http, db, guild_id: int, role_id: int, source: str = "db", apply: bool = False,
+                 requests_per_second: float = 5, workers: int = 2, reason: Optional[str] = None):
+        self.http = http
+        self.db = db
+        self.guild_id = guild_id
+        self.role_id = role_id
+        self.source = source
+        self.apply = apply
+        self.workers = max(workers, 1)
+        self.reason = reason
+
+        self._limiter = RateLimiter(requests_per_second)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 50)
+        self._role_key = str(role_id)
+
+        self.started_at = time.monotonic()
+        self.finished = False
+        self.error: Optional[str] = None
+
+        self.scanned = 0
+        self.in_sync = 0
+        self.missing_role = 0
+        self.extra_role = 0
+        self.not_in_guild = 0
+        self.roles_changed = 0
+        self.role_failures = 0
+        self.db_changed = 0
+
+    async def run(self):
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            self.not_in_guild = await self._scan_members()
+            await self._queue.join()
+        except discord.Forbidden:
+            self.error = "Missing access to the member list, is the Server Members intent enabled for the bot?"
+        except discord.HTTPException as e:
+            self.error = f"Fetching members failed: {e}"
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self.finished = True
+
+    async def _scan_members(self) -> int:
+        """Compare every member against the database, returns how many verified users weren't members"""
+        verified = self.db.verified.get(self.guild_id, set())
+        verified_before = len(verified)
+        verified_in_guild = 0
+        after = None
+
+        while True:
+            page = await self.http.get_members(self.guild_id, MEMBER_PAGE_SIZE, after)
+            for member in page:
+                user = member["user"]
+                if user.get("bot"):
+                    continue
+
+                user_id = int(user["id"])
+                has_role = self._role_key in member["roles"]
+                is_verified = user_id in verified
+                self.scanned += 1
+                verified_in_guild += is_verified
+
+                if has_role == is_verified:
+                    self.in_sync += 1
+                elif is_verified:
+                    self.missing_role += 1
+                    await self._fix(user_id, add=True)
+                else:
+                    self.extra_role += 1
+                    await self._fix(user_id, add=False)
+
+            if len(page) < MEMBER_PAGE_SIZE:
+                # Verified users that weren't found among the members left the guild
+                return verified_before - verified_in_guild
+            after = int(page[-1]["user"]["id"])
+
+    async def _fix(self, user_id: int, add: bool):
+        """``add`` means the user is verified but lacks the role"""
+        if not self.apply:
+            return
+
+        if self.source == "db":
+            await self._queue.put((user_id, add))
+        elif add:
+            self.db.remove_verified(self.guild_id, [user_id])
+            self.db_changed += 1
+        else:
+            self.db.mark_as_verified(user_id, self.guild_id)
+            self.db_changed += 1
+
+    async def _worker(self):
+        while True:
+            user_id, add = await self._queue.get()
+            try:
+                await self._limiter.wait()
+                if add:
+                    await self.http.add_role(self.guild_id, user_id, self.role_id, reason=self.reason)
+                else:
+                    await self.http.remove_role(self.guild_id, user_id, self.role_id, reason=self.reason)
+                self.roles_changed += 1
+            except Exception:
+                # The member may have left meanwhile, or the role is above the bot's
+                self.role_failures += 1
+            finally:
+                self._queue.task_done()
+
+    def progress(self) -> Dict[str, float]:
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "members_scanned": self.scanned,
+            "in_sync": self.in_sync,
+            "verified_without_role": self.missing_role,
+            "role_without_verification": self.extra_role,
+            "verified_not_in_guild": self.not_in_guild,
+            "queued_role_changes": self._queue.qsize(),
+            "roles_changed": self.roles_changed,
+            "role_failures": self.role_failures,
+            "database_changes": self.db_changed,
+            "seconds": round(elapsed, 1),
+        }
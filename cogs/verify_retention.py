@@ -0,0 +1,188 @@
+import asyncio
+import time
+from typing import Dict, Optional, Set
+
+from cogs.verify_db import ROLLUP_TABLES, VerificationDatabase
+
+DAY = 86400
+
+
+class RetentionJob:
+    """Deletes old and orphaned rows in small batches and gives the freed space back to the file system.
+
+    Every ``interval_seconds`` the job deletes the rows of guilds the bot left,
+    events older than ``event_days`` and rollup buckets older than
+    ``minute_rollup_days``/``hour_rollup_days``, then returns up to
+    ``vacuum_pages`` free pages per step with an incremental vacuum and
+    checkpoints the WAL. Every batch of at most ``batch_size`` rows is its own
+    short transaction on the database thread and ``batch_pause`` seconds pass
+    between batches, so queued verification writes go in between instead of
+    waiting for the whole job.
+
+    Without ``maintenance`` only the guilds passed to ``forget_guild`` are
+    deleted. With several processes sharing the file, one of them does the
+    pruning and compacting for all.
+    """
+
+    def __init__(self, db: VerificationDatabase, interval_seconds: float = 3600, batch_size: int = 500,
+                 batch_pause: float = 0.05, event_days: float = 30, minute_rollup_days: float = 2,
+                 hour_rollup_days: float = 90, vacuum_pages: int = 256, maintenance: bool = True):
+        self.db = db
+        self.interval = interval_seconds
+        self.batch_size = max(int(batch_size), 1)
+        self.batch_pause = batch_pause
+        self.event_days = event_days
+        self.rollup_days = {
+            "verification_rollup_minute": minute_rollup_days,
+            "verification_rollup_hour": hour_rollup_days,
+        }
+        self.vacuum_pages = max(int(vacuum_pages), 1)
+        self.maintenance = maintenance
+
+        self._departed_guilds: Set[int] = set()
+        self._purging: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+        self.runs = 0
+        self.last_run_seconds = 0.0
+        self.batches = 0
+        self.guilds_purged = 0
+        self.members_forgotten = 0
+        self.buttons_forgotten = 0
+        self.deleted: Dict[str, int] = {"guild_rows": 0, "events": 0, "rollups": 0}
+        self.pages_vacuumed = 0
+        self.checkpoints = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def forget_guild(self, guild_id: int):
+        """The bot left the guild, its rows are deleted on the next run"""
+        self.db.forget_guild(guild_id)
+        self._departed_guilds.add(guild_id)
+
+    def keep_guild(self, guild_id: int):
+        """The bot was added back, so rows it writes from now on must not be purged.
+
+        Rows that weren't deleted yet are kept as well, after a restart they are
+        loaded again as if the bot had never left.
+        """
+        self._departed_guilds.discard(guild_id)
+        if self._purging == guild_id:
+            self._purging = None
+
+    def forget_member(self, guild_id: int, user_id: int):
+        """The member left, so a rejoin has to verify again"""
+        if self.db.is_verified(user_id, guild_id):
+            self.db.remove_verified(guild_id, [user_id])
+            self.members_forgotten += 1
+
+    def forget_messages(self, message_ids):
+        self.buttons_forgotten += self.db.remove_buttons_for_messages(message_ids)
+
+    async def _batch_done(self):
+        self.batches += 1
+        await asyncio.sleep(self.batch_pause)
+
+    async def _purge_guilds(self):
+        while self._departed_guilds:
+            guild_id = self._departed_guilds.pop()
+            self._purging = guild_id
+            try:
+                # keep_guild stops the purge between batches
+                while self._purging == guild_id:
+                    deleted = await self.db.purge_guild(guild_id, self.batch_size)
+                    self.deleted["guild_rows"] += deleted
+                    await self._batch_done()
+                    if deleted < self.batch_size:
+                        self.guilds_purged += 1
+                        break
+            except Exception:
+                # Try again on the next run
+                if self._purging == guild_id:
+                    self._departed_guilds.add(guild_id)
+                raise
+            finally:
+                self._purging = None
+
+    async def _prune_events(self, now: int):
+        before_id = await self.db.first_event_since(now - int(self.event_days * DAY))
+        while True:
+            deleted = await self.db.prune_events(before_id, self.batch_size)
+            self.deleted["events"] += deleted
+            await self._batch_done()
+            if deleted < self.batch_size:
+                break
+
+    async def _prune_rollups(self, now: int):
+        for table, bucket_seconds in ROLLUP_TABLES.items():
+            before_bucket = (now - int(self.rollup_days[table] * DAY)) // bucket_seconds
+            after_guild: Optional[int] = 0
+            while after_guild is not None:
+                deleted, after_guild = await self.db.prune_rollup(table, before_bucket, after_guild, self.batch_size)
+                self.deleted["rollups"] += deleted
+                await self._batch_done()
+
+    async def _compact(self):
+        while self.db.auto_vacuum_incremental:
+            freed, still_free = await self.db.incremental_vacuum(self.vacuum_pages)
+            self.pages_vacuumed += freed
+            if not freed or not still_free:
+                break
+            await self._batch_done()
+
+        await self.db.checkpoint()
+        self.checkpoints += 1
+
+    async def run(self):
+        """Run all retention steps once, the pending writes are flushed first"""
+        async with self._lock:
+            start = time.perf_counter()
+            now = int(time.time())
+
+            await self.db.flush()
+            await self._purge_guilds()
+            if self.maintenance:
+                await self._prune_events(now)
+                await self._prune_rollups(now)
+                await self._compact()
+
+            self.runs += 1
+            self.last_run_seconds = time.perf_counter() - start
+
+    async def _run_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run()
+            except Exception as e:
+                print(f"Error running the database retention job: {e}")
+
+    async def stats(self) -> Dict[str, float]:
+        page_count, free_pages, page_size = await self.db.file_stats()
+        return {
+            "maintenance": self.maintenance,
+            "runs": self.runs,
+            "last_run_seconds": round(self.last_run_seconds, 2),
+            "batches": self.batches,
+            "guilds_purged": self.guilds_purged,
+            "guilds_pending": len(self._departed_guilds),
+            "members_forgotten": self.members_forgotten,
+            "buttons_forgotten": self.buttons_forgotten,
+            **{f"deleted_{kind}": count for kind, count in self.deleted.items()},
+            "pages_vacuumed": self.pages_vacuumed,
+            "checkpoints": self.checkpoints,
+            "db_size_kb": page_count * page_size // 1024,
+            "free_pages": free_pages,
+        }
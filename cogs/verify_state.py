@@ -0,0 +1,318 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import heapq
+import secrets
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class ChallengeState:
+    """Per-user verification state for one guild"""
+
+    __slots__ = ("solution", "nonce", "attempts", "expires_at")
+
+    def __init__(self, expires_at: float):
+        self.solution: Optional[str] = None
+        self.nonce: Optional[str] = None
+        self.attempts = 0
+        self.expires_at = expires_at
+
+
+class ChallengeStateStore:
+    """Open captchas and failed attempts keyed by ``(guild_id, user_id)``.
+
+    Every entry expires ``ttl`` seconds after it was last touched. Expiry
+    times are kept in a heap and swept periodically, stale heap items (from
+    entries that were touched again) are skipped lazily. At most
+    ``max_entries`` users are tracked, beyond that the entries closest to
+    expiring are evicted first.
+    """
+
+    def __init__(self, ttl: float = 900, max_entries: int = 100_000, sweep_interval: float = 30):
+        self.ttl = ttl
+        self.max_entries = max(max_entries, 1)
+        self.sweep_interval = sweep_interval
+
+        self._entries: Dict[Tuple[int, int], ChallengeState] = {}
+        self._expiry_heap: List[Tuple[float, Tuple[int, int]]] = []
+        self._sweep_task: Optional[asyncio.Task] = None
+
+        self.expirations = 0
+        self.evictions = 0
+        self.peak_entries = 0
+
+    def start(self):
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            try:
+                await self._sweep_task
+            except asyncio.CancelledError:
+                pass
+            self._sweep_task = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get(self, guild_id: int, user_id: int) -> Optional[ChallengeState]:
+        state = self._entries.get((guild_id, user_id))
+        if state is not None and state.expires_at <= time.monotonic():
+            return None
+        return state
+
+    def _touch(self, guild_id: int, user_id: int) -> ChallengeState:
+        key = (guild_id, user_id)
+        now = time.monotonic()
+        state = self._entries.get(key)
+
+        if state is None or state.expires_at <= now:
+            if state is None and len(self._entries) >= self.max_entries:
+                self._evict()
+            state = ChallengeState(0.0)
+            self._entries[key] = state
+            self.peak_entries = max(self.peak_entries, len(self._entries))
+
+        state.expires_at = now + self.ttl
+        heapq.heappush(self._expiry_heap, (state.expires_at, key))
+
+        # Every touch leaves a stale heap item behind, rebuild before it grows too far
+        if len(self._expiry_heap) > 2 * len(self._entries) + 1024:
+            self._expiry_heap = [(state.expires_at, key) for key, state in self._entries.items()]
+            heapq.heapify(self._expiry_heap)
+
+        return state
+
+    def _evict(self):
+        while self._expiry_heap:
+            expires_at, key = heapq.heappop(self._expiry_heap)
+            state = self._entries.get(key)
+            if state is not None and state.expires_at == expires_at:
+                del self._entries[key]
+                self.evictions += 1
+                return
+
+    def sweep(self) -> int:
+        """Remove expired entries, returns how many were removed"""
+        now = time.monotonic()
+        removed = 0
+
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry_heap)
+            state = self._entries.get(key)
+            if state is not None and state.expires_at == expires_at:
+                del self._entries[key]
+                removed += 1
+
+        self.expirations += removed
+        return removed
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
+
+    def set_solution(self, guild_id: int, user_id: int, solution: str) -> str:
+        """Replace the user's open captcha, returns the nonce that identifies the new one"""
+        state = self._touch(guild_id, user_id)
+        state.solution = solution
+        state.nonce = secrets.token_hex(4)
+        return state.nonce
+
+    def get_challenge(self, guild_id: int, user_id: int) -> Optional[Tuple[str, str]]:
+        """Return ``(nonce, solution)`` of the user's newest captcha, None if there is none"""
+        state = self._get(guild_id, user_id)
+        if state is None or state.solution is None:
+            return None
+        return state.nonce, state.solution
+
+    def record_failure(self, guild_id: int, user_id: int) -> int:
+        """Count a wrong answer and return the number of failed attempts so far"""
+        state = self._touch(guild_id, user_id)
+        state.attempts += 1
+        return state.attempts
+
+    def clear(self, guild_id: int, user_id: int):
+        # The heap item goes stale and is skipped by the next sweep
+        self._entries.pop((guild_id, user_id), None)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "live_entries": len(self._entries),
+            "peak_entries": self.peak_entries,
+            "max_entries": self.max_entries,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "heap_size": len(self._expiry_heap),
+        }
+
+
+class LockoutScheduler:
+    """Ends verification timeouts without keeping a sleeping coroutine per user.
+
+    Timeout ends are wall clock timestamps kept in a dict plus a heap. A
+    single task sleeps until the earliest one and then hands every timeout
+    that is due to ``on_expire`` in one batch. Locking someone out with an
+    earlier end than the current earliest wakes the task up early.
+    """
+
+    def __init__(self, on_expire):
+        self.on_expire = on_expire
+
+        self._lockouts: Dict[Tuple[int, int], float] = {}
+        self._heap: List[Tuple[float, Tuple[int, int]]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.lockouts = 0
+        self.expired = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def __len__(self) -> int:
+        return len(self._lockouts)
+
+    def load(self, lockouts: List[Tuple[int, int, float]]):
+        """Restore persisted ``(guild_id, user_id, expires_at)`` timeouts"""
+        for guild_id, user_id, expires_at in lockouts:
+            self._lockouts[(guild_id, user_id)] = expires_at
+            self._heap.append((expires_at, (guild_id, user_id)))
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def lock_out(self, guild_id: int, user_id: int, seconds: float) -> float:
+        """Start a timeout, returns the timestamp it ends at"""
+        key = (guild_id, user_id)
+        expires_at = time.time() + seconds
+
+        if not self._heap or expires_at < self._heap[0][0]:
+            self._wakeup.set()
+
+        self._lockouts[key] = expires_at
+        heapq.heappush(self._heap, (expires_at, key))
+        self.lockouts += 1
+
+        return expires_at
+
+    def remaining(self, guild_id: int, user_id: int) -> float:
+        """Seconds left on the user's timeout, 0 if there is none"""
+        expires_at = self._lockouts.get((guild_id, user_id))
+        if expires_at is None:
+            return 0.0
+        return max(expires_at - time.time(), 0.0)
+
+    def _pop_due(self) -> List[Tuple[int, int]]:
+        now = time.time()
+        due = []
+
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            # Skip heap items for timeouts that were replaced by a later one
+            if self._lockouts.get(key) == expires_at:
+                del self._lockouts[key]
+                due.append(key)
+
+        return due
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            # A timer sets the wakeup event, asyncio.wait_for can swallow
+            # cancellation when the event fires at the same time
+            timer = None
+            if self._heap:
+                delay = max(self._heap[0][0] - time.time(), 0)
+                timer = loop.call_later(delay, self._wakeup.set)
+
+            try:
+                await self._wakeup.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            self._wakeup.clear()
+
+            due = self._pop_due()
+            if due:
+                self.expired += len(due)
+                try:
+                    self.on_expire(due)
+                except Exception as e:
+                    print(f"Error ending verification timeouts: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "active_timeouts": len(self._lockouts),
+            "timeouts_started": self.lockouts,
+            "timeouts_ended": self.expired,
+        }
+
+
+class ChallengeSigner:
+    """Encodes a captcha challenge into a signed token instead of storing it.
+
+    The token carries the guild, user and expiry time plus an HMAC over those
+    and the solution, so an answer can be checked by recomputing the HMAC with
+    the answer in place of the solution. Nothing is kept in memory, any bot
+    process that shares ``secret`` can check the answer, and the token stays
+    valid across restarts until it expires.
+    """
+
+    _PAYLOAD = struct.Struct(">QQI")
+    _TAG_SIZE = 16
+
+    def __init__(self, secret: str, ttl: float = 900):
+        self._secret = secret.encode()
+        self.ttl = ttl
+
+    def _tag(self, payload: bytes, solution: str) -> bytes:
+        message = payload + solution.strip().upper().encode()
+        return hmac.new(self._secret, message, hashlib.sha256).digest()[:self._TAG_SIZE]
+
+    def issue(self, guild_id: int, user_id: int, solution: str) -> str:
+        payload = self._PAYLOAD.pack(guild_id, user_id, int(time.time() + self.ttl))
+        token = payload + self._tag(payload, solution)
+        return base64.urlsafe_b64encode(token).rstrip(b"=").decode()
+
+    def decode(self, token: str) -> Optional[Tuple[int, int, int]]:
+        """Return ``(guild_id, user_id, expires_at)`` from a token, None if it is malformed"""
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        except (binascii.Error, ValueError):
+            return None
+
+        if len(raw) != self._PAYLOAD.size + self._TAG_SIZE:
+            return None
+
+        return self._PAYLOAD.unpack(raw[:self._PAYLOAD.size])
+
+    def is_expired(self, token: str) -> bool:
+        decoded = self.decode(token)
+        return decoded is None or decoded[2] < time.time()
+
+    def check(self, token: str, guild_id: int, user_id: int, answer: str) -> bool:
+        """True if the token belongs to the user, hasn't expired and ``answer`` is its solution"""
+        decoded = self.decode(token)
+        if decoded is None or decoded[:2] != (guild_id, user_id) or decoded[2] < time.time():
+            return False
+
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload, tag = raw[:self._PAYLOAD.size], raw[self._PAYLOAD.size:]
+        return hmac.compare_digest(tag, self._tag(payload, answer))
@@ -0,0 +1,143 @@
+# LAUNCHER
+"""Run the bot as several processes, each owning a range of shards.
+
+Usage: python launcher.py --processes 4 [--shards 16] [--health-interval 30]
+
+Without --shards the shard count recommended by Discord is used. All
+processes share the same verify_config.json and SQLite database, which is
+opened in WAL mode so they can read and write it at the same time.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import queue
+import time
+
+import discord
+
+import main
+
+
+def shard_ranges(shard_count, processes):
+    """Split shard ids 0..shard_count-1 into ``processes`` contiguous ranges"""
+    processes = max(min(processes, shard_count), 1)
+    per_process, extra = divmod(shard_count, processes)
+
+    ranges = []
+    start = 0
+    for index in range(processes):
+        size = per_process + (1 if index < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+async def recommended_shard_count():
+    client = discord.Client(intents=discord.Intents.none())
+    try:
+        await client.login(main.bot_token)
+        data = await client.http.request(discord.http.Route('GET', '/gateway/bot'))
+        return data["shards"]
+    finally:
+        await client.close()
+
+
+def run_process(process_index, process_count, shard_ids, shard_count, health_queue):
+    try:
+        asyncio.run(main.main(
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+            sync_commands=process_index == 0,
+            health_queue=health_queue,
+            process_index=process_index,
+            process_count=process_count
+        ))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_process(context, process_index, process_count, shard_ids, shard_count, health_queue):
+    process = context.Process(
+        target=run_process,
+        args=(process_index, process_count, shard_ids, shard_count, health_queue),
+        name=f"bot-shards-{shard_ids[0]}-{shard_ids[-1]}"
+    )
+    process.start()
+    print(f"Prozess {process_index} (PID {process.pid}) gestartet, Shards {shard_ids[0]}-{shard_ids[-1]}")
+    return process
+
+
+def print_health(health, health_interval):
+    now = time.time()
+    for process_index in sorted(health):
+        report = health[process_index]
+        stale = " (keine Meldung)" if now - report["time"] > health_interval * 3 else ""
+        latencies = ", ".join(f"{shard_id}: {latency}ms" for shard_id, latency in sorted(report["shards"].items()))
+        print(f"[Prozess {process_index}] PID {report['pid']}, {report['guilds']} Server, "
+              f"Loop-Lag {report['loop_lag_ms']}ms, {report['memory_mb']}MB, Latenz {latencies}{stale}")
+
+
+def supervise(context, ranges, shard_count, health_queue, health_interval):
+    """Restart processes that exit and print the health reports they send"""
+    processes = {
+        index: start_process(context, index, len(ranges), shard_ids, shard_count, health_queue)
+        for index, shard_ids in enumerate(ranges)
+    }
+    health = {}
+    restarts = {index: 0 for index in processes}
+    next_print = time.time() + health_interval
+
+    try:
+        while True:
+            try:
+                report = health_queue.get(timeout=1)
+                health[report["process"]] = report
+            except queue.Empty:
+                pass
+
+            for index, process in list(processes.items()):
+                if process.is_alive():
+                    continue
+
+                # Back off a little more every time the same process dies
+                restarts[index] += 1
+                delay = min(5 * restarts[index], 60)
+                print(f"Prozess {index} wurde beendet (Code {process.exitcode}), Neustart in {delay}s...")
+                time.sleep(delay)
+                processes[index] = start_process(context, index, len(ranges), ranges[index], shard_count, health_queue)
+
+            if time.time() >= next_print:
+                print_health(health, health_interval)
+                next_print = time.time() + health_interval
+    except KeyboardInterrupt:
+        print("Launcher wird beendet...")
+    finally:
+        # SIGTERM lets main() close the bot and flush the queued writes, only kill what hangs
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(timeout=30)
+            if process.is_alive():
+                print(f"Prozess {process.name} reagiert nicht und wird hart beendet")
+                process.kill()
+                process.join()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the bot as several sharded processes")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--shards", type=int, default=0, help="total shard count, 0 asks Discord")
+    parser.add_argument("--health-interval", type=int, default=30, help="seconds between health reports")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    shard_count = args.shards or asyncio.run(recommended_shard_count())
+    ranges = shard_ranges(shard_count, args.processes)
+    print(f"Starte {len(ranges)} Prozesse für {shard_count} Shards")
+
+    context = multiprocessing.get_context("spawn")
+    health_queue = context.Queue()
+    supervise(context, ranges, shard_count, health_queue, args.health_interval)
@@ -5,20 +5,60 @@ import discord
 from discord.ext import commands
 import asyncio
 import os
+import signal
+import time
 import logging
-logger = logging.getLogger("discord")
-logger.setLevel(logging.WARNING)
-logger.setLevel(logging.DEBUG)
 
+from cogs.verify_config import load_config, needs_members_intent
 
-intents = discord.Intents.all()
-intents.message_content = True
-intents.message_content = True
-intents.guilds = True
-intents.members = True
-intents.presences = True
+# "minimal" only subscribes to what cogs.verify needs, "full" to everything
+FOOTPRINT = os.getenv("BOT_FOOTPRINT", "minimal")
+LOG_LEVEL = os.getenv("BOT_LOG_LEVEL", "WARNING").upper()
+
+
+def build_intents(footprint=FOOTPRINT, members=False):
+    """Gateway intents for the given footprint.
+
+    The verification flow only needs guilds (role and channel cache) plus
+    guild messages and their content for the ``!`` admin commands. Button
+    clicks arrive as interactions, which need no intent at all, and carry
+    the clicking member, so presences are left off and members are only
+    added when ``members`` is set for settings that need join events.
+    """
+    if footprint == "full":
+        return discord.Intents.all()
+
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.message_content = True
+    intents.members = members
+    return intents
+
+
+def build_member_cache_flags(footprint=FOOTPRINT):
+    if footprint == "full":
+        return discord.MemberCacheFlags.all()
+    return discord.MemberCacheFlags.none()
+
+
+def bot_options(footprint=FOOTPRINT, members=None):
+    """Keyword arguments that control what the bot receives and caches.
+
+    ``members`` defaults to what verify_config.json needs.
+    """
+    if members is None:
+        members = needs_members_intent(load_config())
+    options = {
+        "intents": build_intents(footprint, members),
+        "member_cache_flags": build_member_cache_flags(footprint),
+    }
+    if footprint != "full":
+        # No cog reads old messages or member lists, so don't cache them
+        options["max_messages"] = None
+        options["chunk_guilds_at_startup"] = False
+    return options
 
-bot = commands.Bot(command_prefix="!", intents=intents, application_id=1353299576022372362)
 
 bot_token = "" # YOUR BOT TOKEN
 
@@ -31,7 +71,39 @@ EXTENSIONS = [
 ]
 
 
-async def load_cogs():
+def create_bot(shard_ids=None, shard_count=None, sync_commands=True, process_index=0, process_count=1):
+    """Create the bot, an AutoShardedBot owning only ``shard_ids`` when a shard count is given.
+
+    ``process_index`` and ``process_count`` tell the cogs which of the
+    launcher's processes they run in, so they can share the CPU and ports.
+    """
+    options = bot_options()
+    if shard_count:
+        bot = commands.AutoShardedBot(command_prefix="!", application_id=1353299576022372362,
+                                      shard_ids=shard_ids, shard_count=shard_count, **options)
+    else:
+        bot = commands.Bot(command_prefix="!", application_id=1353299576022372362, **options)
+    bot.process_index = process_index
+    bot.process_count = process_count
+
+    @bot.event
+    async def on_ready():
+        print(f"Bot ist bereit! Eingeloggt als {bot.user}.")
+
+        # With several processes only one of them needs to sync the slash commands
+        if not sync_commands:
+            return
+
+        try:
+            await bot.tree.sync()
+            print("Slash-Commands erfolgreich synchronisiert!")
+        except Exception as e:
+            print(f"Fehler beim Synchronisieren der Commands: {e}")
+
+    return bot
+
+
+async def load_cogs(bot):
     for ext in EXTENSIONS:
         try:
             if ext not in bot.extensions:
@@ -43,27 +115,69 @@ async def load_cogs():
             print(f"Fehler beim Laden der Erweiterung {ext}: {e}")
 
 
-@bot.event
-async def on_ready():
-    print(f"Bot ist bereit! Eingeloggt als {bot.user}.")
-
+def resident_memory_mb():
+    """Current resident memory of this process in MB, 0 where /proc isn't available"""
     try:
-        await bot.tree.sync()
-        print("Slash-Commands erfolgreich synchronisiert!")
-    except Exception as e:
-        print(f"Fehler beim Synchronisieren der Commands: {e}")
-
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return 0.0
+
+
+async def report_health(bot, health_queue, process_index, interval=30):
+    """Send this process' shard latencies, guild count and memory to the launcher"""
+    await bot.wait_until_ready()
+    loop = asyncio.get_running_loop()
+
+    while not bot.is_closed():
+        # How late a short sleep wakes up shows how busy the event loop is
+        start = loop.time()
+        await asyncio.sleep(0.1)
+        loop_lag = loop.time() - start - 0.1
+
+        latencies = bot.latencies if hasattr(bot, "latencies") else [(0, bot.latency)]
+        health_queue.put({
+            "process": process_index,
+            "pid": os.getpid(),
+            "time": time.time(),
+            "shards": {shard_id: round(latency * 1000, 1) for shard_id, latency in latencies},
+            "guilds": len(bot.guilds),
+            "loop_lag_ms": round(loop_lag * 1000, 1),
+            "memory_mb": round(resident_memory_mb(), 1),
+        })
+        await asyncio.sleep(interval)
+
+
+async def main(shard_ids=None, shard_count=None, sync_commands=True, health_queue=None, process_index=0,
+               process_count=1):
+    discord.utils.setup_logging(level=getattr(logging, LOG_LEVEL, logging.WARNING))
+    bot = create_bot(shard_ids, shard_count, sync_commands, process_index, process_count)
+
+    # The launcher stops its processes with SIGTERM, close the bot so the cog's
+    # queued writes are flushed like on Ctrl+C. Windows has no signal handlers here.
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(bot.close()))
+    except (NotImplementedError, AttributeError):
+        pass
 
-async def main():
     try:
         async with bot:
-            await load_cogs()
+            await load_cogs(bot)
+            if health_queue is not None:
+                asyncio.create_task(report_health(bot, health_queue, process_index))
             await bot.start("" + bot_token)
     except KeyboardInterrupt:
         print("Bot wird heruntergefahren...")
     except Exception as e:
         print(f"Unerwarteter Fehler: {e}")
     finally:
+        # Make sure queued verification writes reach the database before exiting
+        verify_cog = bot.get_cog("CaptchaVerification")
+        if verify_cog:
+            try:
+                await verify_cog.flush_pending_writes()
+            except Exception as e:
+                print(f"Fehler beim Speichern der Verifizierungen: {e}")
         await bot.close()
         print("Bot wurde sauber beendet.")
 
@@ -74,4 +188,4 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("Script wurde beendet.")
     except Exception as e:
-        print(f"Unerwarteter Fehler im Hauptskript: {e}")
\ No newline at end of file
+        print(f"Unerwarteter Fehler im Hauptskript: {e}")